@@ -2,12 +2,12 @@ from pathlib import Path
 import warnings
 import os
 from . import agent
+from .uploads import UPLOAD_DIR
 
 # Ensure upload directory exists
-upload_dir = "/tmp/uploads"
-Path(upload_dir).mkdir(parents=True, exist_ok=True)
+Path(UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
 # Read, write, execute for owner; read and execute for others
-os.chmod(upload_dir, 0o755)
+os.chmod(UPLOAD_DIR, 0o755)
 
 # Suppress Pydantic serialization warnings
 warnings.filterwarnings("ignore", message="Pydantic serializer warnings")
@@ -1,21 +1,39 @@
 from google.adk.plugins.save_files_as_artifacts_plugin import SaveFilesAsArtifactsPlugin
+from google.adk.plugins.base_plugin import BasePlugin
 from google.adk.tools.mcp_tool.mcp_session_manager import StdioConnectionParams
 from google.adk.tools.mcp_tool.mcp_session_manager import SseConnectionParams
-from google.adk.tools.mcp_tool.mcp_toolset import McpToolset
 from google.adk.tools.tool_context import ToolContext
 from google.adk.tools.base_tool import BaseTool
 from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.invocation_context import InvocationContext
 from google.adk.agents import LlmAgent
 from google.adk.models import LlmResponse, LlmRequest
-from google.adk.models.lite_llm import LiteLlm
 from google.adk.apps import App
 from google.genai import types
-from mcp import ClientSession, StdioServerParameters
+from mcp import StdioServerParameters
+from mcp.shared.exceptions import McpError
 from mcp.types import CallToolResult, TextContent
-from mcp.client.stdio import stdio_client
 from typing import Dict, Any, Optional, Tuple
 from prompts import Root, Run, Data, Plot, Install
+from r_sessions import RSessions
+from .history import compact_history
+from .llm_cache import CachedLlm
+from .mcp_pool import McpSessionPool, PooledMcpToolset, parse_tool_timeouts
+from . import metrics
+from .metrics import record_time, timed
+from .prompt_cache import (
+    answer_help_from_cache,
+    check_prompt_prefix,
+    clear_help_answers,
+    record_prompt_cache_usage,
+    store_help_answer,
+)
+from .routing import pre_route
+from .summarization import apply_summarization_policy
+from .tracing import setup_tracing, traced
+from .uploads import UPLOAD_DIR, materialize_artifact
 import base64
+import time
 import os
 
 # Define MCP server parameters
@@ -29,31 +47,103 @@ server_params = StdioServerParameters(
 )
 # STDIO transport to local R MCP server
 connection_params = StdioConnectionParams(server_params=server_params, timeout=60)
+# Shared connection pool so that all agents use the same R server processes
+# R_SESSION chooses the first R session (started with mcptools::mcp_session()) that runs the tools
+# and R_POOL_SIZE is the number of R sessions (started by entrypoint.sh or run_web.sh)
+# PLOTMYDATA_IDLE_TIMEOUT (seconds) saves or drops ("save" or "drop" in PLOTMYDATA_IDLE_ACTION)
+# the workspace of an R session that isn't being used
+# PLOTMYDATA_TOOL_TIMEOUT and PLOTMYDATA_TOOL_TIMEOUTS (e.g. "make_plot=120,run_visible=30")
+# are time limits in seconds for tool calls (R reads the same variables)
+# PLOTMYDATA_R_MULTIPLEXER (set by r_sessions.sh) lets the pool restart R sessions that stop
+ready_file_pattern = os.environ.get(
+    "PLOTMYDATA_READY_FILE_PATTERN", "/tmp/plotmydata-R-session-{}.pid"
+)
+r_multiplexer = os.environ.get("PLOTMYDATA_R_MULTIPLEXER")
+r_server = McpSessionPool(
+    connection_params,
+    r_session=int(os.environ.get("R_SESSION", "1")),
+    pool_size=int(os.environ.get("R_POOL_SIZE", "1")),
+    idle_timeout=float(os.environ.get("PLOTMYDATA_IDLE_TIMEOUT", "0")),
+    idle_action=os.environ.get("PLOTMYDATA_IDLE_ACTION", "save"),
+    workspace_dir=os.environ.get("PLOTMYDATA_WORKSPACE_DIR", "/tmp/plotmydata-workspaces"),
+    tool_timeouts=parse_tool_timeouts(os.environ.get("PLOTMYDATA_TOOL_TIMEOUTS", "")),
+    default_timeout=float(os.environ.get("PLOTMYDATA_TOOL_TIMEOUT", "60")),
+    ready_file_pattern=ready_file_pattern,
+    r_sessions=(
+        RSessions(multiplexer=r_multiplexer, ready_file_pattern=ready_file_pattern)
+        if r_multiplexer
+        else None
+    ),
+)
+
+# Export tracing spans if PLOTMYDATA_TRACE_FILE or OTEL_EXPORTER_OTLP_ENDPOINT is set
+setup_tracing()
 
 # Define model
 # If we're using the OpenAI API, get the value of OPENAI_MODEL_NAME set by entrypoint.sh
 # If we're using an OpenAI-compatible endpoint (Docker Model Runner), use a fake API key
-model = LiteLlm(
+# PLOTMYDATA_LLM_CACHE=record, update or replay stores or reuses model responses (e.g. for evals)
+model = CachedLlm(
     model=os.environ.get("OPENAI_MODEL_NAME", ""),
     api_key=os.environ.get("OPENAI_API_KEY", "fake-API-key"),
+    cache_mode=os.environ.get("PLOTMYDATA_LLM_CACHE", "passthrough"),
+    cache_dir=os.environ.get("PLOTMYDATA_LLM_CACHE_DIR", "evals/llm_cache"),
 )
 
 
-async def select_r_session(
-    callback_context: CallbackContext,
-) -> Optional[types.Content]:
+@traced
+async def select_r_session(invocation_context: InvocationContext):
     """
-    Callback function to select the first R session.
+    Select the R session for a user turn.
+    Each ADK session is assigned to one of the pooled R sessions. The pool
+    selects the R session once per MCP connection, so after the first turn
+    this only checks that the connection is available. If the workspace of the
+    session was saved while it was idle, the pool restores it when the session
+    is assigned to a worker again (see McpSessionPool.restore_workspace).
     """
-    async with stdio_client(server_params) as (read, write):
-        async with ClientSession(read, write) as session:
-            await session.initialize()
-            await session.call_tool("select_r_session", {"session": 1})
-            print("[select_r_session] R session selected!")
-    # Return None to allow the LlmAgent's normal execution
-    return None
+    with timed("select_r_session"):
+        await r_server.create_session(r_server.worker_headers(invocation_context))
 
 
+class TurnMetricsPlugin(BasePlugin):
+    """
+    Plugin that selects the R session and records the time taken by each user turn.
+    Runner callbacks run on every turn, including turns that the runner resumes at
+    a sub-agent, which skip the callbacks of the root agent.
+    """
+
+    def __init__(self):
+        super().__init__(name="turn_metrics")
+        # Start times of turns that are in progress, keyed by invocation ID
+        self._turn_starts: Dict[str, float] = {}
+
+    async def before_run_callback(
+        self, *, invocation_context: InvocationContext
+    ) -> Optional[types.Content]:
+        self._turn_starts[invocation_context.invocation_id] = time.perf_counter()
+        await select_r_session(invocation_context)
+        # Return None to run the agents as usual
+        return None
+
+    async def after_run_callback(self, *, invocation_context: InvocationContext) -> None:
+        start_time = self._turn_starts.pop(invocation_context.invocation_id, None)
+        if start_time is None:
+            return
+        latency = time.perf_counter() - start_time
+        record_time("turn", latency)
+        # Log the turn with the statistics of recent turns and R session selections
+        stats = metrics.summary()["timings"]
+        turns, select = stats["turn"], stats["select_r_session"]
+        print(
+            f"[turn_metrics] Turn completed in {latency:.2f} s "
+            f"(R session selected in {select['last_ms']:.1f} ms); "
+            f"last {turns['count']} turns: median {turns['median_ms'] / 1000:.2f} s, "
+            f"p95 {turns['p95_ms'] / 1000:.2f} s; "
+            f"R session selection: median {select['median_ms']:.1f} ms, p95 {select['p95_ms']:.1f} ms"
+        )
+
+
+@traced
 async def catch_tool_errors(tool: BaseTool, args: dict, tool_context: ToolContext):
     """
     Callback function to catch errors from tool calls and turn them into a message.
@@ -64,14 +154,18 @@ async def catch_tool_errors(tool: BaseTool, args: dict, tool_context: ToolContex
     except Exception as e:
         # Format the error as a tool response
         # https://github.com/google/adk-python/commit/4df926388b6e9ebcf517fbacf2f5532fd73b0f71
+        # Tool calls that reach their time limit return a result with isError=True
+        # and structuredContent={"error": "timeout", ...} (see mcp_pool.timeout_result())
+        # Errors from R have class McpError; use e.error.message to get the text
+        message = e.error.message if isinstance(e, McpError) else str(e)
         response = CallToolResult(
-            # The error has class McpError; use e.error.message to get the text
-            content=[TextContent(type="text", text=e.error.message)],
+            content=[TextContent(type="text", text=message)],
             isError=True,
         )
         return response.model_dump(exclude_none=True, mode="json")
 
 
+@traced
 async def preprocess_artifact(
     callback_context: CallbackContext, llm_request: LlmRequest
 ) -> Optional[LlmResponse]:
@@ -96,35 +190,23 @@ async def preprocess_artifact(
 
         # Add a text part only if there are any issues with accessing or saving the artifact
         added_text = ""
-        # List available artifacts
-        artifacts = await callback_context.list_artifacts()
-        if len(artifacts) == 0:
-            added_text = "No uploaded file is available"
-        else:
-            most_recent_file = artifacts[-1]
-            try:
-                # Get artifact and byte data
-                artifact = await callback_context.load_artifact(
-                    filename=most_recent_file
-                )
-                byte_data = artifact.inline_data.data
-                # Save artifact as temporary file
-                tmp_dir = "/tmp/uploads"
-                tmp_file_path = os.path.join(tmp_dir, most_recent_file)
-                # Write the file
-                with open(tmp_file_path, "wb") as f:
-                    f.write(byte_data)
-                # Set appropriate permissions
-                os.chmod(tmp_file_path, 0o644)
-                print(f"[preprocess_artifact] Saved artifact as '{tmp_file_path}'")
-
-            except Exception as e:
-                added_text = f"Error processing artifact: {str(e)}"
+        with timed("preprocess_artifact"):
+            # List available artifacts
+            artifacts = await callback_context.list_artifacts()
+            if len(artifacts) == 0:
+                added_text = "No uploaded file is available"
+            else:
+                most_recent_file = artifacts[-1]
+                try:
+                    # Save artifact as a file (skipped if this version is already saved)
+                    await materialize_artifact(callback_context, most_recent_file)
+                except Exception as e:
+                    added_text = f"Error processing artifact: {str(e)}"
 
         # If there were any issues, add a new part to the user message
+        # (the last content, so that earlier contents stay the same for prompt caching)
         if added_text:
-            # llm_request.contents[-1].parts.append(types.Part(text=added_text))
-            llm_request.contents[0].parts.append(types.Part(text=added_text))
+            llm_request.contents[-1].parts.append(types.Part(text=added_text))
             print(
                 f"[preprocess_artifact] Added text part to user message: '{added_text}'"
             )
@@ -133,6 +215,19 @@ async def preprocess_artifact(
     return None
 
 
+# Marker that SaveFilesAsArtifactsPlugin() adds to a user message, e.g.
+#   [Uploaded Artifact: "breast-cancer.csv"]
+# and the file path used by preprocess_artifact() that replaces it, e.g.
+#   [Uploaded File: "/tmp/uploads/breast-cancer.csv"]
+ARTIFACT_MARKER = '[Uploaded Artifact: "'
+FILE_MARKER = f'[Uploaded File: "{UPLOAD_DIR}/'
+
+
+# Session state key for the ID of the last event checked by preprocess_messages()
+CHECKED_EVENT_KEY = "preprocess_messages_last_event"
+
+
+@traced
 async def preprocess_messages(
     callback_context: CallbackContext, llm_request: LlmRequest
 ) -> Optional[LlmResponse]:
@@ -140,25 +235,45 @@ async def preprocess_messages(
     Callback function to modify user messages to point to temporary artifact file paths.
     """
 
-    # Changes to session state made by callbacks are not preserved across events
-    # See: https://github.com/google/adk-docs/issues/904
-    # Therefore, for every callback invocation we need to loop over all events, not just the most recent one
-    for i in range(len(llm_request.contents)):
-        # Inspect the user message in the request contents
-        user_message = llm_request.contents[i].parts[-1].text
-        if user_message:
-            # Modify file path in user message
-            # Original file path inserted by SaveFilesAsArtifactsPlugin():
-            #   [Uploaded Artifact: "breast-cancer.csv"]
-            # Modified file path used by preprocess_artifact():
-            #   [Uploaded File: "/tmp/uploads/breast-cancer.csv"]
-            tmp_dir = "/tmp/uploads/"
-            if '[Uploaded Artifact: "' in user_message:
-                user_message = user_message.replace(
-                    '[Uploaded Artifact: "', f'[Uploaded File: "{tmp_dir}'
-                )
-                llm_request.contents[i].parts[-1].text = user_message
-                print(f"[preprocess_messages] Modified user message: '{user_message}'")
+    # Only events after the last checked event are checked, so the cost of each call doesn't
+    # grow with the length of the session. The ID of the last checked event is kept in session
+    # state (changes to local variables or the request aren't preserved across model calls).
+    events = callback_context.session.events
+    last_checked = callback_context.state.get(CHECKED_EVENT_KEY)
+    # Look back from the newest event (all events are new if the last checked event isn't found)
+    start = len(events)
+    while start > 0 and events[start - 1].id != last_checked:
+        start -= 1
+    new_events = events[start:]
+    if not new_events:
+        return None
+    callback_context.state[CHECKED_EVENT_KEY] = new_events[-1].id
+
+    for event in new_events:
+        # The plugin adds the marker to the user message
+        if event.author != "user" or not event.content or not event.content.parts:
+            continue
+        part = event.content.parts[-1]
+        if not part.text or ARTIFACT_MARKER not in part.text:
+            continue
+        old_message = part.text
+        user_message = old_message.replace(ARTIFACT_MARKER, FILE_MARKER)
+        # Change the session event so that the contents of later requests are copied from the new message
+        # (InMemorySessionService keeps the same event object, so this also applies to later turns)
+        part.text = user_message
+        # The contents of this request were already copied from the events, and the new
+        # events are at the end of the contents
+        for content in reversed(llm_request.contents[-len(new_events):]):
+            if content.role != "user":
+                continue
+            changed = False
+            for content_part in content.parts or []:
+                if content_part.text == old_message:
+                    content_part.text = user_message
+                    changed = True
+            if changed:
+                break
+        print(f"[preprocess_messages] Modified user message: '{user_message}'")
 
     return None
 
@@ -188,25 +303,7 @@ def detect_file_type(byte_data: bytes) -> Tuple[str, str]:
         return "image/png", "png"
 
 
-async def skip_summarization_for_plot_success(
-    tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Dict
-) -> Optional[Dict]:
-    """
-    Callback function to turn off summarization if plot succeeded.
-    """
-
-    # If there was an error making the plot, the LLM tells the user what happened.
-    # This happens because skip_summarization is False by default.
-
-    # But if the plot was created successfully, there's
-    # no need for an extra LLM call to tell us it's there.
-    if tool.name in ["make_plot", "make_ggplot"]:
-        if not tool_response["isError"]:
-            tool_context.actions.skip_summarization = True
-
-    return None
-
-
+@traced
 async def save_plot_artifact(
     tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Dict
 ) -> Optional[Dict]:
@@ -221,32 +318,40 @@ async def save_plot_artifact(
         # https://github.com/modelcontextprotocol/python-sdk?tab=readme-ov-file#parsing-tool-results
         if "content" in tool_response and not tool_response["isError"]:
             for content in tool_response["content"]:
-                if "type" in content and content["type"] == "text":
-                    # Convert tool response (hex string) to bytes
-                    byte_data = bytes.fromhex(content["text"])
-
-                    # Detect file type from magic number
-                    mime_type, file_extension = detect_file_type(byte_data)
+                if content.get("type") == "image":
+                    # MCP image content carries base64 data
+                    encoded, notes = content["data"], ""
+                elif content.get("type") == "text":
+                    # The plot tools return base64-encoded image data as text,
+                    # followed by notes about any reduction of large data
+                    encoded, _, notes = content["text"].partition("\n")
+                else:
+                    continue
+
+                with timed("plot_decode"):
+                    # Decode only the first few bytes to detect file type from magic number
+                    mime_type, file_extension = detect_file_type(
+                        base64.b64decode(encoded[:16])
+                    )
 
-                    # Encode binary data to Base64 format
-                    encoded = base64.b64encode(byte_data).decode("utf-8")
+                    # The Blob model decodes the base64 string once to get the image bytes
                     artifact_part = types.Part(
-                        inline_data={
-                            "data": encoded,
-                            "mime_type": mime_type,
-                        }
+                        inline_data=types.Blob(data=encoded, mime_type=mime_type)
                     )
-                    # Use second part of tool name (e.g. make_ggplot -> ggplot.png)
-                    filename = f"{tool.name.split("_", 1)[1]}.{file_extension}"
+                # Use second part of tool name (e.g. make_ggplot -> ggplot.png)
+                filename = f"{tool.name.split("_", 1)[1]}.{file_extension}"
+                with timed("artifact_save"):
                     await tool_context.save_artifact(
                         filename=filename, artifact=artifact_part
                     )
-                    # Format the success message as a tool response
-                    text = f"Plot created and saved as an artifact: {filename}"
-                    response = CallToolResult(
-                        content=[TextContent(type="text", text=text)],
-                    )
-                    return response.model_dump(exclude_none=True, mode="json")
+                # Format the success message as a tool response
+                text = f"Plot created and saved as an artifact: {filename}"
+                if notes:
+                    text = f"{text}\n{notes}"
+                response = CallToolResult(
+                    content=[TextContent(type="text", text=text)],
+                )
+                return response.model_dump(exclude_none=True, mode="json")
 
     # Passthrough for other tools or no matching content (e.g. tool error)
     return None
@@ -259,13 +364,27 @@ run_agent = LlmAgent(
     model=model,
     instruction=Run,
     tools=[
-        McpToolset(
-            connection_params=connection_params,
-            tool_filter=["run_visible", "run_hidden"],
+        PooledMcpToolset(
+            session_pool=r_server,
+            tool_filter=[
+                "run_visible",
+                "run_hidden",
+                "get_output",
+                "submit_job",
+                "job_status",
+                "job_result",
+            ],
         )
     ],
-    before_model_callback=[preprocess_artifact, preprocess_messages],
+    before_model_callback=[
+        preprocess_artifact,
+        preprocess_messages,
+        compact_history,
+        check_prompt_prefix,
+    ],
+    after_model_callback=record_prompt_cache_usage,
     before_tool_callback=catch_tool_errors,
+    after_tool_callback=apply_summarization_policy,
 )
 
 # Create agent to load data
@@ -275,13 +394,20 @@ data_agent = LlmAgent(
     model=model,
     instruction=Data,
     tools=[
-        McpToolset(
-            connection_params=connection_params,
-            tool_filter=["run_visible"],
+        PooledMcpToolset(
+            session_pool=r_server,
+            tool_filter=["load_data", "run_visible"],
         )
     ],
-    before_model_callback=[preprocess_artifact, preprocess_messages],
+    before_model_callback=[
+        preprocess_artifact,
+        preprocess_messages,
+        compact_history,
+        check_prompt_prefix,
+    ],
+    after_model_callback=record_prompt_cache_usage,
     before_tool_callback=catch_tool_errors,
+    after_tool_callback=apply_summarization_policy,
 )
 
 # Create agent to make plots using R code
@@ -291,14 +417,21 @@ plot_agent = LlmAgent(
     model=model,
     instruction=Plot,
     tools=[
-        McpToolset(
-            connection_params=connection_params,
-            tool_filter=["make_plot", "make_ggplot"],
+        PooledMcpToolset(
+            session_pool=r_server,
+            tool_filter=["make_plot", "make_ggplot", "job_status", "job_result"],
         )
     ],
-    before_model_callback=[preprocess_artifact, preprocess_messages],
+    before_model_callback=[
+        preprocess_artifact,
+        preprocess_messages,
+        compact_history,
+        check_prompt_prefix,
+    ],
+    after_model_callback=record_prompt_cache_usage,
     before_tool_callback=catch_tool_errors,
-    after_tool_callback=[skip_summarization_for_plot_success, save_plot_artifact],
+    # apply_summarization_policy skips the model call after a plot is made
+    after_tool_callback=[apply_summarization_policy, save_plot_artifact],
 )
 
 # Create agent to install R packages
@@ -308,13 +441,21 @@ install_agent = LlmAgent(
     model=model,
     instruction=Install,
     tools=[
-        McpToolset(
-            connection_params=connection_params,
+        PooledMcpToolset(
+            session_pool=r_server,
             tool_filter=["run_visible"],
         )
     ],
-    before_model_callback=[preprocess_artifact, preprocess_messages],
+    before_model_callback=[
+        preprocess_artifact,
+        preprocess_messages,
+        compact_history,
+        check_prompt_prefix,
+    ],
+    after_model_callback=record_prompt_cache_usage,
     before_tool_callback=catch_tool_errors,
+    # Answers to help questions may change after packages are installed
+    after_tool_callback=[apply_summarization_policy, clear_help_answers],
 )
 
 # Create parent agent and assign children via sub_agents
@@ -326,8 +467,8 @@ root_agent = LlmAgent(
     instruction=Root,
     # To pass control back to root, the help and run functions should be tools or a ToolAgent (not sub_agent)
     tools=[
-        McpToolset(
-            connection_params=connection_params,
+        PooledMcpToolset(
+            session_pool=r_server,
             tool_filter=["help_package", "help_topic"],
         )
     ],
@@ -337,16 +478,25 @@ root_agent = LlmAgent(
         plot_agent,
         install_agent,
     ],
-    # Select R session
-    before_agent_callback=select_r_session,
     # Save user-uploaded artifact as a temporary file and modify messages to point to this file
-    before_model_callback=[preprocess_artifact, preprocess_messages],
+    # answer_help_from_cache and pre_route answer or transfer some requests without a model call
+    before_model_callback=[
+        preprocess_artifact,
+        preprocess_messages,
+        compact_history,
+        answer_help_from_cache,
+        pre_route,
+        check_prompt_prefix,
+    ],
+    after_model_callback=[record_prompt_cache_usage, store_help_answer],
     before_tool_callback=catch_tool_errors,
+    after_tool_callback=apply_summarization_policy,
 )
 
 app = App(
     name="PlotMyData",
     root_agent=root_agent,
-    # This inserts user messages like '[Uploaded Artifact: "breast-cancer.csv"]'
-    plugins=[SaveFilesAsArtifactsPlugin()],
+    # SaveFilesAsArtifactsPlugin inserts user messages like '[Uploaded Artifact: "breast-cancer.csv"]'
+    # TurnMetricsPlugin selects the R session and times each turn
+    plugins=[SaveFilesAsArtifactsPlugin(), TurnMetricsPlugin()],
 )
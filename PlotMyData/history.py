@@ -0,0 +1,191 @@
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+from typing import Any, Dict, List, Optional, Tuple
+from .metrics import increment
+from .tracing import add_event, traced
+import json
+import os
+import re
+
+# Estimated token budget for the request contents (0 turns off compaction under the budget)
+HISTORY_TOKEN_BUDGET = int(os.environ.get("PLOTMYDATA_HISTORY_TOKENS", "16000"))
+# Fraction of the budget that the contents are compacted down to when they go over the budget
+HISTORY_LOW_WATER = float(os.environ.get("PLOTMYDATA_HISTORY_LOW_WATER", "0.5"))
+# Number of most recent tool results that are always kept in full
+KEEP_RESULTS = int(os.environ.get("PLOTMYDATA_HISTORY_KEEP_RESULTS", "4"))
+# Session state key prefix for the number of oldest tool results that are compacted for an agent
+STATE_KEY = "history_compacted_results"
+
+# Tools that return help pages
+HELP_TOOLS = {"help_package", "help_topic"}
+# Base64 image data (PNG, JPEG, or GIF) that is long enough to be a plot
+IMAGE_DATA_PATTERN = re.compile(r"^(iVBORw0KGgo|/9j/|R0lGOD)[A-Za-z0-9+/=]{200,}")
+# Characters kept from the start of an output in its stub
+STUB_CHARS = 200
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in text (about 4 characters per token for English and code).
+    """
+    return (len(text) + 3) // 4
+
+
+def response_text(response: Optional[Dict[str, Any]]) -> str:
+    """
+    Get the text of a tool response (the text content of MCP tool results).
+    """
+    if not response:
+        return ""
+    content = response.get("content")
+    if isinstance(content, list):
+        return "\n".join(
+            item.get("text", "") for item in content if isinstance(item, dict)
+        )
+    return json.dumps(response, default=str)
+
+
+def part_tokens(part: types.Part) -> int:
+    """
+    Estimate the number of tokens in a part of a message.
+    """
+    if part.text:
+        return estimate_tokens(part.text)
+    if part.function_call:
+        return estimate_tokens(json.dumps(part.function_call.args or {}, default=str))
+    if part.function_response:
+        return estimate_tokens(response_text(part.function_response.response))
+    return 0
+
+
+def stub_text(text: str, reason: str, preview: bool = True) -> str:
+    """
+    Make a short stub for the text of a tool response.
+    The stub includes the start of the output if `preview` is True.
+    """
+    stub = f"[{reason}; {len(text)} characters"
+    if preview:
+        stub += f". Start of output: {text[:STUB_CHARS].rstrip()}"
+        if len(text) > STUB_CHARS:
+            stub += " ..."
+    return stub + "]"
+
+
+def stub_response(part: types.Part, text: str, reason: str, preview: bool = True) -> int:
+    """
+    Replace a tool response with a short stub and return the estimated number of tokens saved.
+    """
+    response = part.function_response.response or {}
+    before = estimate_tokens(response_text(response))
+    stub = stub_text(text, reason, preview)
+    new_response: Dict[str, Any] = {"content": [{"type": "text", "text": stub}]}
+    if response.get("isError"):
+        new_response["isError"] = True
+    part.function_response.response = new_response
+    return max(0, before - estimate_tokens(stub))
+
+
+def compaction_plan(
+    names: List[str], texts: List[str], boundary: int
+) -> List[Tuple[int, str, bool]]:
+    """
+    Get the tool responses to replace with stubs (index, reason, and whether to show the start of the output).
+
+    The plan depends only on the responses and the boundary, so the same history
+    is compacted in the same way in every request.
+    """
+    plan = []
+    kept_help = set()
+    for i, (name, text) in enumerate(zip(names, texts)):
+        if IMAGE_DATA_PATTERN.match(text):
+            plan.append((i, "Image data omitted", False))
+        elif i < boundary:
+            plan.append((i, "Old tool output omitted to save context", True))
+        elif name in HELP_TOOLS and text in kept_help:
+            plan.append((i, "Same help page as an earlier result", False))
+        elif name in HELP_TOOLS:
+            kept_help.add(text)
+    return plan
+
+
+def plan_tokens(plan: List[Tuple[int, str, bool]], texts: List[str]) -> int:
+    """
+    Estimate the number of tokens saved by a compaction plan.
+    """
+    return sum(
+        max(0, estimate_tokens(texts[i]) - estimate_tokens(stub_text(texts[i], reason, preview)))
+        for i, reason, preview in plan
+    )
+
+
+@traced
+async def compact_history(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> Optional[LlmResponse]:
+    """
+    Callback function to keep the request contents within a token budget.
+
+    The contents of a request are copies of the session events, so the history
+    in the session is unchanged. Provider prompt caching needs the start of the
+    contents to stay the same between requests, so compaction is deterministic:
+    - Image data in tool results (e.g. when a plot couldn't be saved as an artifact) is always omitted
+    - A help page that repeats an earlier (kept) result is omitted
+    - The oldest tool results, up to a boundary kept in session state for each agent, are replaced with stubs
+    When the contents go over the budget, the boundary is moved forward in one
+    step until they are within HISTORY_LOW_WATER of the budget (the newest
+    KEEP_RESULTS results are always kept). The contents then grow again for
+    several requests before the next step changes the cached prefix.
+    """
+    # Tool responses from oldest to newest
+    responses: List[types.Part] = [
+        part
+        for content in llm_request.contents
+        for part in (content.parts or [])
+        if part.function_response
+    ]
+    if not responses:
+        return None
+    total = sum(
+        part_tokens(part)
+        for content in llm_request.contents
+        for part in (content.parts or [])
+    )
+    names = [part.function_response.name for part in responses]
+    texts = [response_text(part.function_response.response) for part in responses]
+    state_key = f"{STATE_KEY}_{callback_context.agent_name}"
+    boundary = min(callback_context.state.get(state_key, 0), len(responses))
+    plan = compaction_plan(names, texts, boundary)
+    saved = plan_tokens(plan, texts)
+    # Move the boundary forward when the contents are over the budget
+    limit = max(0, len(responses) - KEEP_RESULTS) if KEEP_RESULTS > 0 else len(responses)
+    if HISTORY_TOKEN_BUDGET > 0 and total - saved > HISTORY_TOKEN_BUDGET and boundary < limit:
+        target = HISTORY_TOKEN_BUDGET * HISTORY_LOW_WATER
+        start = boundary
+        while boundary < limit and total - saved > target:
+            boundary += 1
+            plan = compaction_plan(names, texts, boundary)
+            saved = plan_tokens(plan, texts)
+        callback_context.state[state_key] = boundary
+        increment("history_compaction_steps")
+        add_event(
+            "history_compaction_step",
+            {"agent": callback_context.agent_name, "from": start, "to": boundary},
+        )
+        print(
+            f"[compact_history] Compacted tool outputs {start + 1}-{boundary} for {callback_context.agent_name}"
+        )
+    for i, reason, preview in plan:
+        stub_response(responses[i], texts[i], reason, preview)
+
+    if saved:
+        increment("history_compactions")
+        increment("history_tokens_saved", saved)
+        add_event(
+            "history_compacted",
+            {"tokens_before": total, "tokens_saved": saved, "stubs": len(plan)},
+        )
+        print(
+            f"[compact_history] Saved about {saved} of {total} tokens ({len(plan)} tool outputs stubbed)"
+        )
+    return None
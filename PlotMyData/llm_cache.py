@@ -0,0 +1,159 @@
+from google.adk.models import LlmResponse, LlmRequest
+from google.adk.models.lite_llm import LiteLlm
+from typing import AsyncGenerator, List
+from .metrics import increment, record_time
+from .uploads import UPLOAD_DIR
+import hashlib
+import gzip
+import json
+import os
+import re
+import tempfile
+import time
+
+# Cache modes:
+# "record": always call the model and store its response (replacing a stored response)
+# "update": use a stored response if there is one, otherwise call the model and store its response
+# "replay": only use stored responses (a request that isn't stored raises LlmCacheMiss)
+# "passthrough": always call the model and don't store anything
+CACHE_MODES = ("record", "update", "replay", "passthrough")
+
+# Tool results that change from run to run (see load_data() in server.R)
+VOLATILE_PATTERN = re.compile(r"(Load time|Peak memory): [0-9.]+ (s|MB)")
+
+# Placeholder for the upload directory, so responses recorded by one eval
+# worker can be replayed by another with a different upload directory
+UPLOAD_DIR_PLACEHOLDER = "$PLOTMYDATA_UPLOAD_DIR"
+
+
+class LlmCacheMiss(RuntimeError):
+    """
+    Raised in replay mode when a request has no stored response.
+    """
+
+
+def request_key(model: str, llm_request: LlmRequest) -> str:
+    """
+    Get the cache key for a request: a hash of the model, contents, system instruction and tools.
+
+    Function call IDs and volatile parts of tool results are left out of the key.
+    """
+    request = llm_request.model_dump(
+        mode="json",
+        exclude_none=True,
+        include={"contents": True, "config": {"system_instruction", "tools"}},
+    )
+    for content in request.get("contents", []):
+        for part in content.get("parts", []):
+            for field in ("function_call", "function_response"):
+                if field in part:
+                    part[field].pop("id", None)
+    text = json.dumps({"model": model, **request}, sort_keys=True)
+    text = VOLATILE_PATTERN.sub(r"\1: -", text).replace(UPLOAD_DIR, UPLOAD_DIR_PLACEHOLDER)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedLlm(LiteLlm):
+    """
+    LiteLlm model with a record/replay cache of responses.
+
+    Responses for each request are stored as a gzipped JSON lines file (a cassette)
+    named by the request key in `cache_dir`. The time spent getting responses
+    from the model is recorded as the "llm" timing.
+    """
+
+    cache_mode: str = "passthrough"
+    cache_dir: str = "evals/llm_cache"
+
+    def __init__(
+        self,
+        model: str,
+        cache_mode: str = "passthrough",
+        cache_dir: str = "evals/llm_cache",
+        **kwargs,
+    ):
+        # Other arguments are passed to the litellm completion API
+        super().__init__(model=model, **kwargs)
+        if cache_mode not in CACHE_MODES:
+            raise ValueError(
+                f"LLM cache mode must be one of {', '.join(CACHE_MODES)}, not '{cache_mode}'"
+            )
+        self.cache_mode = cache_mode
+        self.cache_dir = cache_dir
+
+    def _cassette_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.jsonl.gz")
+
+    def _load_cassette(self, path: str) -> List[LlmResponse]:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return [
+                LlmResponse.model_validate_json(
+                    line.replace(UPLOAD_DIR_PLACEHOLDER, UPLOAD_DIR)
+                )
+                for line in f
+                if line.strip()
+            ]
+
+    def _save_cassette(self, path: str, responses: List[LlmResponse]):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        lines = [
+            response.model_dump_json(exclude_none=True).replace(
+                UPLOAD_DIR, UPLOAD_DIR_PLACEHOLDER
+            )
+            for response in responses
+        ]
+        # Write to a temporary file then rename it, so parallel eval workers never read a partial cassette
+        with tempfile.NamedTemporaryFile(
+            dir=self.cache_dir, prefix=".cassette-", delete=False
+        ) as f:
+            with gzip.open(f, "wt", encoding="utf-8") as gz:
+                gz.write("\n".join(lines) + "\n")
+        os.replace(f.name, path)
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        if self.cache_mode == "passthrough":
+            async for response in self._generate_timed(llm_request, stream):
+                yield response
+            return
+
+        key = request_key(self.model, llm_request)
+        path = self._cassette_path(key)
+        # Record mode doesn't look up stored responses, so it refreshes them
+        if self.cache_mode != "record" and os.path.exists(path):
+            increment("llm_cache_hits")
+            for response in self._load_cassette(path):
+                yield response
+            return
+
+        if self.cache_mode != "record":
+            increment("llm_cache_misses")
+        if self.cache_mode == "replay":
+            raise LlmCacheMiss(
+                f"No recorded LLM response for request {key[:12]} in {self.cache_dir} (replay mode)"
+            )
+
+        responses = []
+        async for response in self._generate_timed(llm_request, stream):
+            responses.append(response)
+            yield response
+        # Don't store errors, so the request is tried again next time
+        if responses and not any(response.error_code for response in responses):
+            self._save_cassette(path, responses)
+            print(f"[CachedLlm] Recorded LLM response {key[:12]}")
+
+    async def _generate_timed(
+        self, llm_request: LlmRequest, stream: bool
+    ) -> AsyncGenerator[LlmResponse, None]:
+        """
+        Get responses from the model and record the time spent waiting for them.
+        """
+        elapsed = 0.0
+        start = time.perf_counter()
+        async for response in super().generate_content_async(llm_request, stream):
+            elapsed += time.perf_counter() - start
+            yield response
+            start = time.perf_counter()
+        elapsed += time.perf_counter() - start
+        record_time("llm", elapsed)
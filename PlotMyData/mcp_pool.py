@@ -0,0 +1,625 @@
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.mcp_tool.mcp_session_manager import MCPSessionManager
+from google.adk.tools.mcp_tool.mcp_session_manager import StdioConnectionParams
+from google.adk.tools.mcp_tool.mcp_toolset import McpToolset
+from google.adk.tools.base_toolset import ToolPredicate
+from mcp import ClientSession
+from mcp.shared.exceptions import McpError
+from mcp.types import CallToolResult, TextContent
+from datetime import timedelta
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+from .metrics import increment, record_time, set_gauge
+from .tracing import TracedSession, add_event
+import asyncio
+import httpx
+import os
+import signal
+import time
+
+# Header that tells the pool which R worker a request is for
+WORKER_HEADER = "X-PlotMyData-R-Session"
+
+
+def parse_tool_timeouts(spec: str) -> Dict[str, float]:
+    """
+    Parse time limits (seconds) for tools from a spec like "make_plot=120,run_visible=30".
+    """
+    timeouts = {}
+    for item in spec.split(","):
+        if item.strip():
+            name, _, seconds = item.partition("=")
+            timeouts[name.strip()] = float(seconds)
+    return timeouts
+
+
+def timeout_result(tool: str, timeout: float, interrupted: bool) -> CallToolResult:
+    """
+    Make the result of a tool call that was stopped at its time limit.
+
+    The error is returned instead of raised because ADK retries MCP tool calls
+    that raise an exception, which would run the slow code again.
+    """
+    text = (
+        f"Timed out: {tool} was stopped after {timeout:g} s. The R session is still usable, "
+        "but objects assigned by the code may be incomplete. Try faster code, e.g. using a subset of the data."
+    )
+    return CallToolResult(
+        content=[TextContent(type="text", text=text)],
+        structuredContent={
+            "error": "timeout",
+            "tool": tool,
+            "timeout_seconds": timeout,
+            "interrupted": interrupted,
+        },
+        isError=True,
+    )
+
+
+class WorkerSession(TracedSession):
+    """
+    Pooled MCP session whose tool calls wait until the R worker is free.
+    """
+
+    def __init__(self, session: ClientSession, pool: "McpSessionPool", worker: int):
+        super().__init__(session)
+        self._pool = pool
+        self._worker = worker
+
+    async def call_tool(self, name: str, arguments: Optional[Dict[str, Any]] = None, **kwargs):
+        start = time.perf_counter()
+        async with self._pool._worker_locks[self._worker]:
+            record_time("r_worker_wait", time.perf_counter() - start)
+            # R stops the tool at its time limit (see with_time_limit() in functions.R);
+            # the client waits a little longer before interrupting the R session
+            timeout = self._pool.tool_timeout(name)
+            kwargs["read_timeout_seconds"] = timedelta(
+                seconds=timeout + self._pool.interrupt_grace
+            )
+            try:
+                result = await super().call_tool(name, arguments, **kwargs)
+            except McpError as e:
+                if e.error.code == httpx.codes.REQUEST_TIMEOUT:
+                    # R didn't stop the code (e.g. it was stuck in compiled code)
+                    interrupted = await self._pool._interrupt_worker(self._worker, self._session)
+                    return timeout_result(name, timeout, interrupted)
+                if "Timed out:" not in e.error.message:
+                    raise
+                result = None
+            finally:
+                self._pool._mark_used(self._worker)
+        # R stopped the code at the time limit (with_time_limit() makes an error with "Timed out:")
+        if result is None or (
+            result.isError
+            and result.content
+            and "Timed out:" in getattr(result.content[0], "text", "")
+        ):
+            increment("r_tool_timeouts")
+            add_event("r_tool_timeout", {"tool": name, "r_session": self._worker})
+            return timeout_result(name, timeout, interrupted=False)
+        return result
+
+
+class McpSessionPool(MCPSessionManager):
+    """
+    MCP session manager shared by all toolsets that connect to the R server.
+
+    By default every McpToolset creates its own session manager, so each agent
+    starts a separate `Rscript server.R` subprocess. One pool shared by all
+    toolsets keeps long-lived connections instead. Connections that have not
+    been used for `health_check_interval` seconds are pinged before they are
+    handed out, and a connection that fails the check is closed and replaced
+    with a new one.
+
+    The MCP server forwards tool calls to the R session chosen with its
+    `select_r_session` tool. The pool has `pool_size` R workers: the R sessions
+    numbered from `r_session` up, each with its own MCP connection. Each ADK
+    session is assigned to the worker with the fewest recently active sessions
+    and keeps using it (see `worker_headers`). Tool calls for a worker are run
+    one at a time, so requests queue while the worker is busy.
+
+    Every `check_interval` seconds, the memory used by workers that were used
+    since the last check is recorded (see `workspace_usage`). If `idle_timeout`
+    is set, the workspace of a worker that hasn't been used for that many
+    seconds is saved to `workspace_dir` and removed from memory (`idle_action`
+    "save"), or just removed ("drop"). Its ADK sessions are then assigned to
+    workers again when they are next used. The R workspace is shared by all
+    ADK sessions on a worker, so it is only saved if one ADK session used the
+    worker since its workspace was last emptied, and it is only restored into a
+    worker that no other ADK session has used since then (see
+    `restore_workspace`). Otherwise the workspace is dropped.
+
+    Each tool call has a time limit (`tool_timeouts`, or `default_timeout` for
+    other tools). R stops the code when the limit is reached, but it can only do
+    that while R code is running. If no result arrives `interrupt_grace` seconds
+    later, the R process (with its ID in `ready_file_pattern`) is sent SIGINT
+    and the MCP connection, which is still waiting for the result, is replaced.
+
+    A worker whose R process has stopped (its process ID in the ready file no
+    longer exists) is restarted with `r_sessions` (an RSessions object) when
+    its next MCP session is requested and at every check. Without
+    `r_sessions`, ADK sessions assigned to a stopped worker fail over to
+    another running worker.
+    """
+
+    def __init__(
+        self,
+        connection_params,
+        r_session: int = 1,
+        pool_size: int = 1,
+        health_check_interval: float = 30.0,
+        health_check_timeout: float = 5.0,
+        affinity_ttl: float = 3600.0,
+        idle_timeout: float = 0.0,
+        idle_action: str = "save",
+        workspace_dir: str = "/tmp/plotmydata-workspaces",
+        check_interval: float = 60.0,
+        tool_timeouts: Optional[Dict[str, float]] = None,
+        default_timeout: float = 60.0,
+        interrupt_grace: float = 5.0,
+        ready_file_pattern: str = "/tmp/plotmydata-R-session-{}.pid",
+        r_sessions=None,
+        **kwargs,
+    ):
+        super().__init__(connection_params, **kwargs)
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        # R sessions (from mcptools::mcp_session()) that tool calls go to
+        self.r_session = r_session
+        self.workers = list(range(r_session, r_session + max(1, pool_size)))
+        # ADK sessions that haven't been used for this many seconds don't count toward a worker's load
+        self.affinity_ttl = affinity_ttl
+        # Worker and last use time for each ADK session
+        self._affinity: Dict[str, Tuple[int, float]] = {}
+        # Worker for each session key
+        self._key_workers: Dict[str, int] = {}
+        # Tool calls for each worker wait for this lock
+        self._worker_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # R session selected on each pooled connection
+        self._selected_r_session: Dict[str, int] = {}
+        # Time that each pooled session was last known to be healthy
+        self._last_healthy: Dict[str, float] = {}
+        # Number of connections opened for each session key (including reconnects)
+        self.connection_count: Dict[str, int] = {}
+        # Idle workspace eviction and memory accounting
+        self.idle_timeout = idle_timeout
+        self.idle_action = idle_action
+        self.workspace_dir = workspace_dir
+        self.check_interval = check_interval
+        # Time that each worker was last used by an agent
+        self._worker_last_used: Dict[int, float] = {}
+        # Workers used since their memory was last recorded
+        self._workers_used: Set[int] = set()
+        # Workers whose workspace was evicted and that haven't been used since
+        self._evicted: Set[int] = set()
+        # ADK sessions that used each worker since its workspace was last emptied
+        self._workspace_sessions: Dict[int, Set[str]] = defaultdict(set)
+        # Saved workspace file for each ADK session whose worker was evicted
+        self._saved_workspaces: Dict[str, str] = {}
+        # Latest memory usage of each worker, e.g. {"objects": 3, "workspace_mb": 152.3, ...}
+        self.workspace_usage: Dict[int, Dict[str, float]] = {}
+        self._monitor: Optional[asyncio.Task] = None
+        # Time limits for tool calls
+        self.tool_timeouts = tool_timeouts or {}
+        self.default_timeout = default_timeout
+        self.interrupt_grace = interrupt_grace
+        self.ready_file_pattern = ready_file_pattern
+        # Restarts stopped workers (see r_sessions.py)
+        self.r_sessions = r_sessions
+        # Toolsets that use the pool (it is closed when the last one is closed)
+        self._toolsets: Set[McpToolset] = set()
+
+    def worker_headers(self, readonly_context) -> Dict[str, str]:
+        """
+        Header provider for toolsets that routes each ADK session to its R worker.
+        """
+        if readonly_context is None:
+            return {WORKER_HEADER: str(self.workers[0])}
+        return {WORKER_HEADER: str(self.assign_worker(readonly_context.session.id))}
+
+    def assign_worker(self, session_id: str) -> int:
+        """
+        Get the R worker for an ADK session, assigning one if needed.
+        """
+        now = time.monotonic()
+        assigned = self._affinity.get(session_id)
+        if assigned is not None and self.r_sessions is None and not self._worker_alive(assigned[0]):
+            # The worker can't be restarted, so use another one (the session's R objects are lost)
+            if any(self._worker_alive(worker) for worker in self.workers):
+                del self._affinity[session_id]
+                assigned = None
+                increment("r_worker_failovers")
+                add_event("r_worker_failover", {"session_id": session_id})
+        if assigned is not None:
+            worker = assigned[0]
+        else:
+            # Forget sessions that are no longer active
+            for stale_id in [
+                id
+                for id, (_, last_used) in self._affinity.items()
+                if now - last_used > self.affinity_ttl
+            ]:
+                del self._affinity[stale_id]
+            load = {worker: 0 for worker in self.workers}
+            for worker, _ in self._affinity.values():
+                load[worker] = load.get(worker, 0) + 1
+            workers = self.workers
+            if self.r_sessions is None:
+                workers = [worker for worker in self.workers if self._worker_alive(worker)] or workers
+            worker = min(workers, key=lambda worker: (load[worker], worker))
+            increment("r_worker_assignments")
+            print(f"[McpSessionPool] Session {session_id} assigned to R session {worker}")
+        self._affinity[session_id] = (worker, now)
+        self._workspace_sessions[worker].add(session_id)
+        return worker
+
+    def _merge_headers(
+        self, additional_headers: Optional[Dict[str, str]] = None
+    ) -> Optional[Dict[str, str]]:
+        """
+        Keep the worker header for stdio connections (the parent class drops all headers for them).
+        """
+        merged_headers = super()._merge_headers(additional_headers)
+        if merged_headers is None and additional_headers and WORKER_HEADER in additional_headers:
+            # stdio_client() doesn't use headers, so this only affects the session key
+            merged_headers = {WORKER_HEADER: additional_headers[WORKER_HEADER]}
+        return merged_headers
+
+    def _generate_session_key(
+        self, merged_headers: Optional[Dict[str, str]] = None
+    ) -> str:
+        """
+        Use a separate connection for each R worker (the parent class uses one key for all stdio connections).
+        """
+        worker = int((merged_headers or {}).get(WORKER_HEADER, self.workers[0]))
+        if isinstance(self._connection_params, StdioConnectionParams):
+            session_key = f"stdio_session_{worker}"
+        else:
+            session_key = super()._generate_session_key(
+                {**(merged_headers or {}), WORKER_HEADER: str(worker)}
+            )
+        self._key_workers[session_key] = worker
+        return session_key
+
+    async def create_session(
+        self, headers: Optional[Dict[str, str]] = None
+    ) -> ClientSession:
+        """
+        Get a pooled MCP session, reconnecting if the existing one is unhealthy.
+        The session is wrapped so that its tool calls are traced and wait for the R worker.
+        """
+        session_key = self._generate_session_key(self._merge_headers(headers))
+        if self._monitor is None:
+            self._monitor = asyncio.create_task(self._monitor_workers())
+        worker = self._key_workers[session_key]
+        if self.r_sessions is not None and not self._worker_alive(worker):
+            await self._restart_worker(worker)
+        # Restore saved workspaces before the first tool call of their ADK sessions on this worker
+        # (any agent may make that call, because a turn can start at a sub-agent)
+        for session_id in [
+            session_id
+            for session_id in self._saved_workspaces
+            if self._affinity.get(session_id, (None, 0))[0] == worker
+        ]:
+            await self.restore_workspace(session_id)
+
+        while True:
+            pooled = self._sessions.get(session_key)
+            # The parent class reuses a connected session or opens a new one
+            session = await super().create_session(headers=headers)
+
+            if pooled is None or pooled[0] is not session:
+                # A new connection was just made
+                self.connection_count[session_key] = (
+                    self.connection_count.get(session_key, 0) + 1
+                )
+                self._last_healthy[session_key] = time.monotonic()
+                self._selected_r_session.pop(session_key, None)
+                increment("mcp_connections")
+                print(f"[McpSessionPool] Connected to MCP server ({session_key})")
+                add_event("mcp_connected", {"session_key": session_key})
+                await self._select_r_session(session_key, session)
+                return WorkerSession(session, self, self._key_workers[session_key])
+
+            idle_time = time.monotonic() - self._last_healthy.get(session_key, 0)
+            if idle_time < self.health_check_interval or await self._is_healthy(
+                session
+            ):
+                self._last_healthy[session_key] = time.monotonic()
+                await self._select_r_session(session_key, session)
+                return WorkerSession(session, self, self._key_workers[session_key])
+
+            print(f"[McpSessionPool] Health check failed; reconnecting ({session_key})")
+            increment("mcp_health_check_failures")
+            add_event("mcp_health_check_failed", {"session_key": session_key})
+            await self._discard_session(session_key, session)
+
+    def tool_timeout(self, name: str) -> float:
+        """
+        Get the time limit (seconds) for a tool.
+        """
+        return self.tool_timeouts.get(name, self.default_timeout)
+
+    async def _interrupt_worker(self, worker: int, session: ClientSession) -> bool:
+        """
+        Interrupt the R code running in a worker and replace its MCP connection.
+
+        Returns True if the R process was sent SIGINT.
+        """
+        increment("r_tool_timeouts")
+        increment("r_interrupts")
+        add_event("r_interrupt", {"r_session": worker})
+        interrupted = False
+        try:
+            with open(self.ready_file_pattern.format(worker)) as f:
+                pid = int(f.read().strip())
+            # Like pressing Ctrl-C in the R console: R stops the evaluation and keeps its workspace
+            os.kill(pid, signal.SIGINT)
+            interrupted = True
+            print(f"[McpSessionPool] Interrupted R session {worker} (pid {pid})")
+        except (OSError, ValueError) as e:
+            print(f"[McpSessionPool] Couldn't interrupt R session {worker}: {e}")
+        # The MCP server is still waiting for the result of the interrupted call
+        for session_key, key_worker in list(self._key_workers.items()):
+            if key_worker == worker:
+                await self._discard_session(session_key, session)
+        return interrupted
+
+    def _worker_alive(self, worker: int) -> bool:
+        """
+        Check if the R process of a worker is running.
+
+        A worker without a readable ready file counts as running (e.g. an R session started by hand).
+        """
+        try:
+            with open(self.ready_file_pattern.format(worker)) as f:
+                pid = int(f.read().strip())
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except (OSError, ValueError):
+            pass
+        return True
+
+    async def _restart_worker(self, worker: int):
+        """
+        Start a new R session for a worker whose R process has stopped and replace its MCP connections.
+
+        The new R session has an empty workspace.
+        """
+        async with self._worker_locks[worker]:
+            # Another task may have already restarted the worker
+            if self._worker_alive(worker):
+                return
+            increment("r_worker_restarts")
+            add_event("r_worker_restart", {"r_session": worker})
+            print(f"[McpSessionPool] R session {worker} stopped; restarting")
+            await self.r_sessions.restart(worker)
+        # Select the new R session on a new connection
+        for session_key, key_worker in list(self._key_workers.items()):
+            pooled = self._sessions.get(session_key)
+            if key_worker == worker and pooled is not None:
+                await self._discard_session(session_key, pooled[0])
+        self._evicted.discard(worker)
+        self._workspace_sessions.pop(worker, None)
+        self.workspace_usage.pop(worker, None)
+
+    def _mark_used(self, worker: int):
+        self._worker_last_used[worker] = time.monotonic()
+        self._workers_used.add(worker)
+        self._evicted.discard(worker)
+
+    async def _call_worker_tool(
+        self, worker: int, name: str, arguments: Dict[str, Any]
+    ) -> str:
+        """
+        Call a tool on a worker without counting it as use of the worker, and return the text result.
+        """
+        session = await self.create_session({WORKER_HEADER: str(worker)})
+        async with self._worker_locks[worker]:
+            result = await session._session.call_tool(name, arguments)
+        text = "\n".join(
+            content.text for content in result.content if getattr(content, "text", None)
+        )
+        if result.isError:
+            raise RuntimeError(text)
+        return text
+
+    async def _monitor_workers(self):
+        """
+        Periodically restart stopped workers, record the memory used by workers, and evict idle workspaces.
+        """
+        while True:
+            await asyncio.sleep(self.check_interval)
+            if self.r_sessions is not None:
+                for worker in self.workers:
+                    if not self._worker_alive(worker):
+                        try:
+                            await self._restart_worker(worker)
+                        except Exception as e:
+                            print(f"[McpSessionPool] Error restarting R session {worker}: {e}")
+            now = time.monotonic()
+            for worker, last_used in list(self._worker_last_used.items()):
+                try:
+                    if self.idle_timeout > 0 and worker not in self._evicted:
+                        if now - last_used > self.idle_timeout:
+                            await self._evict_workspace(worker)
+                            continue
+                    if worker in self._workers_used:
+                        await self._record_usage(worker)
+                except Exception as e:
+                    print(f"[McpSessionPool] Error checking R session {worker}: {e}")
+
+    async def _record_usage(self, worker: int):
+        """
+        Record the memory used by a worker's workspace and R session.
+        """
+        self._workers_used.discard(worker)
+        text = await self._call_worker_tool(worker, "workspace_usage", {})
+        usage = {}
+        for item in text.split():
+            name, _, value = item.partition("=")
+            usage[name] = float(value)
+        self.workspace_usage[worker] = usage
+        for name, value in usage.items():
+            set_gauge(f"r_session_{worker}_{name}", value)
+
+    async def _evict_workspace(self, worker: int):
+        """
+        Save or drop the workspace of an idle worker and unassign its ADK sessions.
+        """
+        sessions = [
+            session_id
+            for session_id, (assigned, _) in self._affinity.items()
+            if assigned == worker
+        ]
+        # Saving is only useful if there is an ADK session to restore the workspace for,
+        # and the workspace of a worker used by several ADK sessions has objects from all of them
+        owners = set(self._workspace_sessions.get(worker, ()))
+        if self.idle_action == "save" and len(owners) == 1 and owners <= set(sessions):
+            os.makedirs(self.workspace_dir, exist_ok=True)
+            file = os.path.join(
+                self.workspace_dir, f"R-session-{worker}-{time.time_ns()}.RData"
+            )
+            arguments = {"action": "save", "file": file}
+        else:
+            file = None
+            arguments = {"action": "drop"}
+        text = await self._call_worker_tool(worker, "evict_workspace", arguments)
+        self._workspace_sessions.pop(worker, None)
+        for session_id in sessions:
+            del self._affinity[session_id]
+        if file is not None:
+            self._saved_workspaces[owners.pop()] = file
+        self._evicted.add(worker)
+        self._workers_used.add(worker)
+        increment("r_workspace_evictions")
+        print(f"[McpSessionPool] R session {worker} was idle: {text}")
+
+    async def restore_workspace(self, session_id: str):
+        """
+        Restore the saved workspace of an ADK session into its (new) worker.
+
+        This is called by create_session() when the session has been assigned to a
+        worker again, and the workspace is removed from the saved workspaces so
+        that it is restored only once.
+
+        The workspace is dropped instead if another ADK session has used the worker,
+        so that its objects aren't mixed with the other session's objects.
+        """
+        file = self._saved_workspaces.pop(session_id, None)
+        if file is None or not os.path.exists(file):
+            return
+        worker = self.assign_worker(session_id)
+        if self._workspace_sessions[worker] - {session_id}:
+            os.remove(file)
+            increment("r_workspace_restore_skips")
+            print(
+                f"[McpSessionPool] Session {session_id} on R session {worker}: "
+                "saved workspace dropped (the R session is used by another session)"
+            )
+            return
+        text = await self._call_worker_tool(worker, "restore_workspace", {"file": file})
+        self._mark_used(worker)
+        os.remove(file)
+        increment("r_workspace_restores")
+        print(f"[McpSessionPool] Session {session_id} on R session {worker}: {text}")
+
+    def open_toolset(self, toolset: McpToolset):
+        """
+        Count a toolset that uses the pool.
+        """
+        self._toolsets.add(toolset)
+
+    async def close_toolset(self, toolset: McpToolset):
+        """
+        Stop counting a toolset, and close the pool after the last toolset is closed.
+        The pool opens connections again if a toolset is used after it was closed.
+        """
+        self._toolsets.discard(toolset)
+        if not self._toolsets:
+            await self.close()
+
+    async def close(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        await super().close()
+
+    async def _select_r_session(self, session_key: str, session: ClientSession):
+        """
+        Select the target R session unless it is already selected on this connection.
+        """
+        r_session = self._key_workers.get(session_key, self.r_session)
+        if self._selected_r_session.get(session_key) == r_session:
+            return
+        await session.call_tool("select_r_session", {"session": r_session})
+        self._selected_r_session[session_key] = r_session
+        increment("r_session_selections")
+        print(f"[select_r_session] R session {r_session} selected!")
+
+    async def _is_healthy(self, session: ClientSession) -> bool:
+        """
+        Check that the MCP server still responds to a ping.
+        """
+        try:
+            await asyncio.wait_for(
+                session.send_ping(), timeout=self.health_check_timeout
+            )
+            return True
+        except Exception:
+            return False
+
+    async def _discard_session(self, session_key: str, session: ClientSession):
+        """
+        Close a pooled session so that the next request opens a new connection.
+        """
+        async with self._session_lock:
+            pooled = self._sessions.get(session_key)
+            # Another task may have already replaced the session
+            if pooled is None or pooled[0] is not session:
+                return
+            del self._sessions[session_key]
+            self._last_healthy.pop(session_key, None)
+            self._selected_r_session.pop(session_key, None)
+        try:
+            await pooled[1].aclose()
+        except Exception as e:
+            # The dead connection may not close cleanly (e.g. when closed from a different task)
+            print(f"[McpSessionPool] Error closing unhealthy session: {e}")
+
+
+class PooledMcpToolset(McpToolset):
+    """
+    McpToolset that draws its connection from a shared McpSessionPool.
+    The tool filter still applies, so each agent sees only its own tools.
+    """
+
+    def __init__(
+        self,
+        *,
+        session_pool: McpSessionPool,
+        tool_filter: Optional[Union[ToolPredicate, List[str]]] = None,
+        **kwargs,
+    ):
+        # Route each ADK session to its R worker
+        kwargs.setdefault("header_provider", session_pool.worker_headers)
+        super().__init__(
+            connection_params=session_pool._connection_params,
+            tool_filter=tool_filter,
+            **kwargs,
+        )
+        # Replace the toolset's own session manager with the shared pool
+        self._mcp_session_manager = session_pool
+        self._session_pool = session_pool
+        session_pool.open_toolset(self)
+
+    async def get_tools(self, readonly_context: Optional[ReadonlyContext] = None) -> List[BaseTool]:
+        # Count the toolset again if it is used after being closed (e.g. by a new runner)
+        self._session_pool.open_toolset(self)
+        return await super().get_tools(readonly_context)
+
+    async def close(self):
+        # Other toolsets share the pool, so it is closed only after all of them are closed
+        await self._session_pool.close_toolset(self)
@@ -0,0 +1,86 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, List
+import math
+import time
+
+# Number of recent durations kept for each timing
+MAX_TIMINGS = 1000
+
+# Event counts, e.g. counters["mcp_reconnects"]
+counters: Dict[str, int] = defaultdict(int)
+# Recent durations in seconds, e.g. timings["select_r_session"]
+timings: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=MAX_TIMINGS))
+# Latest values, e.g. gauges["r_session_1_workspace_mb"]
+gauges: Dict[str, float] = {}
+
+
+def increment(name: str, value: int = 1):
+    """
+    Add to a counter.
+    """
+    counters[name] += value
+
+
+def set_gauge(name: str, value: float):
+    """
+    Set the latest value of a gauge.
+    """
+    gauges[name] = value
+
+
+def record_time(name: str, seconds: float):
+    """
+    Record one duration for a timing.
+    """
+    timings[name].append(seconds)
+
+
+@contextmanager
+def timed(name: str):
+    """
+    Context manager that records the duration of its block.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(name, time.perf_counter() - start)
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """
+    Get a percentile (0-100) of sorted values using the nearest-rank method.
+    """
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summary() -> Dict[str, Any]:
+    """
+    Get counters and timing statistics (in milliseconds) as a dict.
+    """
+    timing_stats = {}
+    for name, values in timings.items():
+        if not values:
+            continue
+        ms = sorted(value * 1000 for value in values)
+        timing_stats[name] = {
+            "count": len(ms),
+            "mean_ms": sum(ms) / len(ms),
+            "median_ms": ms[len(ms) // 2],
+            "p95_ms": percentile(ms, 95),
+            "p99_ms": percentile(ms, 99),
+            "max_ms": ms[-1],
+            "last_ms": values[-1] * 1000,
+        }
+    return {"counters": dict(counters), "gauges": dict(gauges), "timings": timing_stats}
+
+
+def reset():
+    """
+    Clear all counters, gauges and timings.
+    """
+    counters.clear()
+    gauges.clear()
+    timings.clear()
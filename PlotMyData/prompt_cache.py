@@ -0,0 +1,242 @@
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.tool_context import ToolContext
+from google.genai import types
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from .history import response_text
+from .metrics import counters, increment, set_gauge
+from .routing import first_model_call
+from .tracing import add_event, traced
+import hashlib
+import json
+import os
+import re
+
+# Provider prompt caching reuses the longest byte-identical prefix of a request:
+# the system instruction (agent instructions), then the tool declarations (from
+# prompts.R), then the conversation. Callbacks that change a request should only
+# change or append to its last content so that earlier contents stay identical.
+
+# Fingerprint of the system instruction and tools in the last request of each agent
+_prefix_hashes: Dict[str, str] = {}
+# Number of contents and fingerprint of the contents in the last request of each agent in each session
+# (least recently used first)
+_contents_hashes: "OrderedDict[Tuple[str, str], Tuple[int, str]]" = OrderedDict()
+# Number of agent sessions whose contents fingerprints are kept
+CONTENTS_HASHES_SIZE = 1000
+
+# Number of answers to help questions kept in the cache (0 turns off the cache)
+HELP_CACHE_SIZE = int(os.environ.get("PLOTMYDATA_HELP_CACHE_SIZE", "256"))
+# Tools used by the Coordinator to answer help questions
+HELP_TOOLS = {"help_package", "help_topic"}
+# Questions that only ask for documentation, e.g. "?boxplot", "help(lm)", or "Show the help page for datasets"
+HELP_QUESTION_PATTERN = re.compile(
+    r"\s*(\?\s*[\w.:]+|help\s*\(\s*[\w.:\"']+\s*\)|"
+    r"((show|get|give me)\s+)?(the\s+)?(help|documentation|docs)(\s+page)?\s+(for|on|of|about)\s+"
+    r"(the\s+)?[\w.:\"'()]+(\s+(function|package|dataset))?)\s*[.!?]?\s*",
+    re.IGNORECASE,
+)
+# Answers to help questions, keyed by the normalized question (least recently used first)
+_help_answers: "OrderedDict[str, str]" = OrderedDict()
+# Text of help tool results for a topic that wasn't found (see help_topic() in server.R)
+HELP_NOT_FOUND = "No help found"
+# R code that installs packages
+INSTALL_CODE_PATTERN = re.compile(
+    r"\binstall\.packages\s*\(|\bBiocManager::install\s*\(|\bremotes::install_\w+\s*\(|\bpak::pkg_install\s*\("
+)
+
+
+def prefix_hash(llm_request: LlmRequest) -> str:
+    """
+    Get a fingerprint of the parts of a request that should be the same in every call for an agent.
+    """
+    config = llm_request.config
+    system_instruction = config.system_instruction if config else None
+    tools = [tool.model_dump(mode="json", exclude_none=True) for tool in (config.tools or [])] if config else []
+    data = json.dumps([str(system_instruction), tools], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def contents_hashes(llm_request: LlmRequest):
+    """
+    Get a running fingerprint of the request contents (the fingerprint of the first n contents for each n).
+    """
+    digest = hashlib.sha256()
+    for content in llm_request.contents:
+        digest.update(content.model_dump_json(exclude_none=True).encode())
+        yield digest.hexdigest()
+
+
+@traced
+async def check_prompt_prefix(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> Optional[LlmResponse]:
+    """
+    Callback function to count changes to an agent's instructions, tools, or earlier contents between model calls.
+
+    Any change means that the provider can't reuse its cached prompt prefix.
+    The contents of the previous request of the agent in the session should be
+    the start of the contents of this request (e.g. they change when compact_history()
+    replaces more tool results with stubs).
+    This should be the last before_model_callback, after the other callbacks have changed the request.
+    """
+    agent_name = callback_context.agent_name
+    fingerprint = prefix_hash(llm_request)
+    previous = _prefix_hashes.get(agent_name)
+    _prefix_hashes[agent_name] = fingerprint
+    if previous is not None and previous != fingerprint:
+        increment("prompt_prefix_changes")
+        add_event("prompt_prefix_changed", {"agent": agent_name})
+        print(f"[check_prompt_prefix] Instructions or tools changed for {agent_name}")
+
+    key = (callback_context.session.id, agent_name)
+    hashes = list(contents_hashes(llm_request))
+    previous_contents = _contents_hashes.pop(key, None)
+    if hashes:
+        _contents_hashes[key] = (len(hashes), hashes[-1])
+        while len(_contents_hashes) > CONTENTS_HASHES_SIZE:
+            _contents_hashes.popitem(last=False)
+    if previous_contents is not None:
+        n, previous_hash = previous_contents
+        if n > len(hashes) or hashes[n - 1] != previous_hash:
+            increment("prompt_contents_changes")
+            add_event("prompt_contents_changed", {"agent": agent_name})
+            print(f"[check_prompt_prefix] Earlier contents changed for {agent_name}")
+    return None
+
+
+@traced
+async def record_prompt_cache_usage(
+    callback_context: CallbackContext, llm_response: LlmResponse
+) -> Optional[LlmResponse]:
+    """
+    Callback function to record the number of prompt tokens that were read from the provider's cache.
+    """
+    usage = llm_response.usage_metadata
+    if usage is None or not usage.prompt_token_count:
+        return None
+    cached = usage.cached_content_token_count or 0
+    agent_name = callback_context.agent_name
+    increment("prompt_tokens", usage.prompt_token_count)
+    increment("cached_prompt_tokens", cached)
+    increment(f"prompt_tokens_{agent_name}", usage.prompt_token_count)
+    increment(f"cached_prompt_tokens_{agent_name}", cached)
+    set_gauge("prompt_cache_ratio", counters["cached_prompt_tokens"] / counters["prompt_tokens"])
+    set_gauge(
+        f"prompt_cache_ratio_{agent_name}",
+        counters[f"cached_prompt_tokens_{agent_name}"] / counters[f"prompt_tokens_{agent_name}"],
+    )
+    return None
+
+
+def help_question_key(text: str) -> Optional[str]:
+    """
+    Get the cache key for a help question (None if the text isn't only a help question).
+    """
+    if not HELP_QUESTION_PATTERN.fullmatch(text):
+        return None
+    return " ".join(text.lower().split()).rstrip(".!?")
+
+
+@traced
+async def answer_help_from_cache(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> Optional[LlmResponse]:
+    """
+    Callback function to answer a repeated help question with the Coordinator's earlier answer.
+
+    Help pages are the same for all users, so answers are shared between sessions.
+    """
+    if HELP_CACHE_SIZE <= 0 or not first_model_call(callback_context, llm_request):
+        return None
+    text = "\n".join(part.text for part in (llm_request.contents[-1].parts or []) if part.text)
+    key = help_question_key(text)
+    if key is None:
+        return None
+    answer = _help_answers.get(key)
+    if answer is None:
+        increment("help_cache_misses")
+        return None
+    _help_answers.move_to_end(key)
+    increment("help_cache_hits")
+    add_event("help_cache_hit", {"question": key})
+    print(f"[answer_help_from_cache] Answered '{key}' from the cache")
+    return LlmResponse(content=types.Content(role="model", parts=[types.Part(text=answer)]))
+
+
+@traced
+async def store_help_answer(
+    callback_context: CallbackContext, llm_response: LlmResponse
+) -> Optional[LlmResponse]:
+    """
+    Callback function to save the Coordinator's answer to a help question.
+
+    The answer is saved only if the Coordinator answered by itself in this turn
+    using the help tools (no transfers or other tools), and the help tools found
+    the help pages (no errors or topics that weren't found, which may be found
+    after a package is installed).
+    """
+    if HELP_CACHE_SIZE <= 0 or not llm_response.content or not llm_response.content.parts:
+        return None
+    parts = llm_response.content.parts
+    if any(part.function_call for part in parts):
+        return None
+    answer = "".join(part.text for part in parts if part.text and not part.thought)
+    if not answer:
+        return None
+    events = [
+        event
+        for event in callback_context.session.events
+        if event.invocation_id == callback_context.invocation_id
+    ]
+    question = "\n".join(
+        part.text
+        for event in events
+        if event.author == "user" and event.content
+        for part in (event.content.parts or [])
+        if part.text
+    )
+    calls = [call for event in events for call in event.get_function_calls()]
+    responses = [
+        response.response or {}
+        for event in events
+        for response in event.get_function_responses()
+    ]
+    if (
+        not calls
+        or any(call.name not in HELP_TOOLS for call in calls)
+        or any(event.author not in ("user", callback_context.agent_name) for event in events)
+        or any(response.get("isError") for response in responses)
+        or any(HELP_NOT_FOUND in response_text(response) for response in responses)
+    ):
+        return None
+    key = help_question_key(question)
+    if key is None:
+        return None
+    _help_answers[key] = answer
+    _help_answers.move_to_end(key)
+    while len(_help_answers) > HELP_CACHE_SIZE:
+        _help_answers.popitem(last=False)
+    return None
+
+
+@traced
+async def clear_help_answers(
+    tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Dict
+) -> Optional[Dict]:
+    """
+    Callback function to clear the cached help answers after R packages are installed.
+
+    Help for a new package can change the answer to a question, e.g. for a topic that wasn't found before.
+    """
+    if not isinstance(tool_response, dict) or tool_response.get("isError", True):
+        return None
+    if not INSTALL_CODE_PATTERN.search(str((args or {}).get("code", ""))):
+        return None
+    if _help_answers:
+        increment("help_cache_clears")
+        print(f"[clear_help_answers] Cleared {len(_help_answers)} help answers after installing packages")
+        _help_answers.clear()
+    return None
@@ -0,0 +1,120 @@
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.events import Event
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+from typing import List, Optional, Tuple
+from .metrics import increment
+from .tracing import add_event, traced
+import os
+import re
+
+# Set PLOTMYDATA_PREROUTE=0 to always let the model choose the agent
+PREROUTE = os.environ.get("PLOTMYDATA_PREROUTE", "1") != "0"
+
+# Words that ask for a plot
+PLOT_PATTERN = re.compile(
+    r"\b(plot|plots|ggplot|ggplot2|chart|graph|histogram|boxplot|barplot|scatterplot|visuali[sz]e)\b",
+    re.IGNORECASE,
+)
+# Messages that only ask to install packages, e.g. "install ggrepel" or "Please install the vcd and hexbin packages."
+INSTALL_PATTERN = re.compile(
+    r"^\s*(please\s+)?install\s+(the\s+)?(r\s+)?(packages?\s+)?"
+    r"[A-Za-z][A-Za-z0-9.]*(\s*(,|and|&)\s*[A-Za-z][A-Za-z0-9.]*)*"
+    r"(\s+(r\s+)?packages?)?\s*[.!]?\s*$",
+    re.IGNORECASE,
+)
+# Messages about other data or tasks, which the model should route
+OTHER_DATA_PATTERN = re.compile(
+    r"https?://|\bdata ?sets?\b|\bload|\bread\b|\bfile\b|\bcsv\b|\binstall|\bhelp\b|\?|"
+    r"\bcalculate\b|\bcompute\b|\brun\b|\bjob\b",
+    re.IGNORECASE,
+)
+# Text added to the user message for an uploaded file (see preprocess_messages() in agent.py)
+UPLOAD_PATTERN = re.compile(r"\[Uploaded (Artifact|File): ")
+
+
+def route_message(text: str, data_loaded: bool) -> Optional[Tuple[str, str]]:
+    """
+    Choose an agent for a user message with rules for unambiguous requests.
+
+    Returns the agent name and the name of the rule, or None if the model should choose.
+    """
+    uploaded = bool(UPLOAD_PATTERN.search(text))
+    # Remove the upload text so the file name doesn't affect the other rules
+    request = UPLOAD_PATTERN.split(text)[0]
+    wants_plot = bool(PLOT_PATTERN.search(request))
+    if uploaded:
+        # A file without a plot request is loaded and summarized
+        if not wants_plot and not INSTALL_PATTERN.match(request):
+            return "Data", "upload"
+        return None
+    if INSTALL_PATTERN.match(request):
+        return "Install", "install"
+    if wants_plot and data_loaded and not OTHER_DATA_PATTERN.search(request):
+        return "Plot", "plot_loaded_data"
+    return None
+
+
+def data_loaded(events: List[Event]) -> bool:
+    """
+    Check if the Data agent has loaded data in this session.
+    """
+    for event in events:
+        if event.author != "Data":
+            continue
+        for response in event.get_function_responses():
+            if not (response.response or {}).get("isError"):
+                return True
+    return False
+
+
+def first_model_call(callback_context: CallbackContext, llm_request: LlmRequest) -> bool:
+    """
+    Check if this is the first model call of a turn (no agent has responded yet).
+    """
+    # An agent may have already responded in this turn (e.g. control was transferred back)
+    if any(
+        event.invocation_id == callback_context.invocation_id and event.author != "user"
+        for event in callback_context.session.events
+    ):
+        return False
+    return bool(llm_request.contents) and llm_request.contents[-1].role == "user"
+
+
+@traced
+async def pre_route(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> Optional[LlmResponse]:
+    """
+    Callback function to transfer to an agent without a model call when the request is unambiguous.
+
+    This only applies to the first model call of a turn. Otherwise (or if no rule
+    matches) the model chooses what to do.
+    """
+    if not PREROUTE or not first_model_call(callback_context, llm_request):
+        return None
+    session = callback_context.session
+    text = "\n".join(
+        part.text for part in (llm_request.contents[-1].parts or []) if part.text
+    )
+    route = route_message(text, data_loaded(session.events))
+    if route is None:
+        increment("preroute_misses")
+        return None
+    agent_name, rule = route
+    increment("preroute_hits")
+    increment(f"preroute_rule_{rule}")
+    add_event("preroute", {"agent": agent_name, "rule": rule})
+    print(f"[pre_route] Transferring to {agent_name} ({rule})")
+    return LlmResponse(
+        content=types.Content(
+            role="model",
+            parts=[
+                types.Part(
+                    function_call=types.FunctionCall(
+                        name="transfer_to_agent", args={"agent_name": agent_name}
+                    )
+                )
+            ],
+        )
+    )
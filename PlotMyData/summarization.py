@@ -0,0 +1,153 @@
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.tool_context import ToolContext
+from typing import Any, Dict, List, Optional
+from .metrics import increment
+from .tracing import add_event, traced
+import json
+import os
+import re
+
+# After a tool call, the agent's model is normally called again to summarize the result.
+# Each rule says when that call isn't needed and what to do instead:
+#   tools:        names of the tools that the rule applies to
+#   agents:       names of the agents that the rule applies to (default: all agents)
+#   args_pattern: regular expression that must be found in the tool arguments (as JSON)
+#   pattern:      regular expression that must match the whole text of a successful result
+#   action:       "skip" to show the tool result without a summary,
+#                 "reply" to replace the result with the text in `reply` and show it without a summary,
+#                 or "return" to transfer back to the agent that transferred to this one
+#                 (or "skip" if the user or the Coordinator asked for this agent)
+# The first matching rule is used. Set PLOTMYDATA_SUMMARIZATION_RULES to the path of a
+# JSON file with a list of rules to use instead of these.
+DEFAULT_RULES: List[Dict[str, Any]] = [
+    # The plot is shown as an artifact, so there's nothing to summarize
+    {"tools": ["make_plot", "make_ggplot"], "pattern": r".*", "action": "skip"},
+    # There is no rule for run_hidden: its result is usually one step of a longer request
+    # (e.g. assigning a variable that is used next), so skipping the model call would end the turn early
+    # The packages needed by another agent are already installed, so go back to that agent
+    {
+        "tools": ["run_visible"],
+        "agents": ["Install"],
+        "args_pattern": r"check_packages\(",
+        "pattern": r"[\w.]+((, [\w.]+)*,? and [\w.]+ are| is) already installed",
+        "action": "return",
+    },
+]
+
+# Session state key for the number of model calls avoided in the session
+# (only "skip" and "reply", which end the turn; transfers by "return" are counted in summary_returns)
+STATE_KEY = "llm_calls_avoided"
+
+
+def load_rules() -> List[Dict[str, Any]]:
+    """
+    Get the summarization rules from the file in PLOTMYDATA_SUMMARIZATION_RULES, or the default rules.
+    """
+    rules_file = os.environ.get("PLOTMYDATA_SUMMARIZATION_RULES")
+    if not rules_file:
+        return DEFAULT_RULES
+    with open(rules_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+RULES = load_rules()
+
+
+def result_text(tool_response: Dict) -> str:
+    """
+    Get the text of a tool result.
+    """
+    return "\n".join(
+        content.get("text", "")
+        for content in tool_response.get("content", [])
+        if content.get("type") == "text"
+    )
+
+
+def match_rule(
+    tool_name: str, agent_name: str, args: Dict[str, Any], tool_response: Dict
+) -> Optional[Dict[str, Any]]:
+    """
+    Get the first rule that matches a successful tool result, or None.
+    """
+    if not isinstance(tool_response, dict) or tool_response.get("isError", True):
+        return None
+    text = None
+    for rule in RULES:
+        if tool_name not in rule["tools"]:
+            continue
+        if "agents" in rule and agent_name not in rule["agents"]:
+            continue
+        if "args_pattern" in rule and not re.search(
+            rule["args_pattern"], json.dumps(args, default=str)
+        ):
+            continue
+        if text is None:
+            text = result_text(tool_response)
+        if re.fullmatch(rule["pattern"], text.strip(), re.DOTALL):
+            return rule
+    return None
+
+
+def requesting_agent(tool_context: ToolContext) -> Optional[str]:
+    """
+    Get the agent that transferred to the current agent in this turn (None for the user or the Coordinator).
+    """
+    agent_name = tool_context.agent_name
+    for event in reversed(tool_context.session.events):
+        if event.invocation_id != tool_context.invocation_id:
+            break
+        for call in event.get_function_calls():
+            if call.name == "transfer_to_agent" and (call.args or {}).get("agent_name") == agent_name:
+                return None if event.author == "Coordinator" else event.author
+    return None
+
+
+@traced
+async def apply_summarization_policy(
+    tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Dict
+) -> Optional[Dict]:
+    """
+    Callback function to avoid the model call that summarizes a tool result (see DEFAULT_RULES).
+
+    This should be the first after_tool_callback, because other callbacks that
+    change the tool response (like save_plot_artifact) end the list of callbacks.
+    """
+    rule = match_rule(tool.name, tool_context.agent_name, args, tool_response)
+    if rule is None:
+        return None
+    action = rule["action"]
+    new_response = None
+    if action == "return":
+        agent_name = requesting_agent(tool_context)
+        if agent_name is not None:
+            tool_context.actions.transfer_to_agent = agent_name
+        else:
+            action = "skip"
+    if action == "reply":
+        new_response = {
+            "content": [{"type": "text", "text": rule["reply"]}],
+            "isError": False,
+        }
+    if action in ("skip", "reply"):
+        tool_context.actions.skip_summarization = True
+
+    if action == "return":
+        # The other agent's model is called next, so the turn doesn't end here and
+        # the transfer is counted separately from the model calls that end a turn
+        increment("summary_returns")
+        increment(f"summary_returns_{tool.name}")
+        add_event("summarization_return", {"tool": tool.name, "agent": agent_name})
+        print(f"[apply_summarization_policy] {tool.name} (return to {agent_name})")
+        return None
+
+    # Count the avoided model calls for the session (in session state) and for all sessions
+    tool_context.state[STATE_KEY] = tool_context.state.get(STATE_KEY, 0) + 1
+    increment("llm_calls_avoided")
+    increment(f"llm_calls_avoided_{tool.name}")
+    add_event("summarization_avoided", {"tool": tool.name, "action": action})
+    print(
+        f"[apply_summarization_policy] {tool.name} ({action}); "
+        f"{tool_context.state[STATE_KEY]} model calls avoided in this session"
+    )
+    return new_response
@@ -0,0 +1,179 @@
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from typing import Any, Dict, Optional, Sequence
+import functools
+import os
+import re
+import threading
+import time
+
+# ADK records spans for invocations, agents, model calls and tools ("invoke_agent Plot",
+# "call_llm", "execute_tool make_plot"); this tracer adds spans for our callbacks,
+# MCP tool calls and the steps of running R code
+tracer = trace.get_tracer("plotmydata")
+
+# Timings line added to plot tool results by the R session (see plot_tool_result() in functions.R),
+# e.g. "[timings] start=1760000000.123456 parse=0.000512 eval=0.210000 device=0.031000"
+TIMINGS_PATTERN = re.compile(r"^\[timings\] (.*)$", re.MULTILINE)
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """
+    Span exporter that appends each span to a file as one line of JSON.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        with self._lock:
+            for span in spans:
+                self._file.write(span.to_json(indent=None) + "\n")
+            self._file.flush()
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        with self._lock:
+            self._file.close()
+
+
+def setup_tracing():
+    """
+    Export spans if PLOTMYDATA_TRACE_FILE or an OTLP endpoint is set.
+
+    PLOTMYDATA_TRACE_FILE names a JSON lines file for spans. The OTLP exporter
+    uses the standard OTEL_EXPORTER_OTLP_ENDPOINT (or ..._TRACES_ENDPOINT)
+    variable. `adk web` sets up its own tracer provider and OTLP exporter from
+    the same variables, so in that case only the file exporter is added.
+    """
+    trace_file = os.environ.get("PLOTMYDATA_TRACE_FILE")
+    otlp_endpoint = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT") or os.environ.get(
+        "OTEL_EXPORTER_OTLP_TRACES_ENDPOINT"
+    )
+    if not trace_file and not otlp_endpoint:
+        return
+
+    provider = trace.get_tracer_provider()
+    if not isinstance(provider, TracerProvider):
+        provider = TracerProvider(
+            resource=Resource.create({"service.name": "plotmydata"})
+        )
+        trace.set_tracer_provider(provider)
+        if otlp_endpoint:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    if trace_file:
+        provider.add_span_processor(
+            BatchSpanProcessor(JsonLinesSpanExporter(trace_file))
+        )
+
+
+def traced(callback):
+    """
+    Decorator that records a span for each call of an async agent callback.
+    """
+    name = f"callback {callback.__name__}"
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        with tracer.start_as_current_span(name) as span:
+            context = kwargs.get("callback_context") or kwargs.get("tool_context")
+            if context is not None:
+                span.set_attribute("plotmydata.agent", context.agent_name)
+            tool = kwargs.get("tool")
+            if tool is not None:
+                span.set_attribute("plotmydata.tool", tool.name)
+            return await callback(*args, **kwargs)
+
+    return wrapper
+
+
+def add_event(name: str, attributes: Optional[Dict[str, Any]] = None):
+    """
+    Add an event to the current span (does nothing if tracing isn't set up).
+    """
+    trace.get_current_span().add_event(name, attributes or {})
+
+
+def parse_timings(text: str) -> Optional[Dict[str, float]]:
+    """
+    Get the R timings from a tool result, or None if there are none.
+    """
+    match = TIMINGS_PATTERN.search(text)
+    if not match:
+        return None
+    timings = {}
+    for item in match.group(1).split():
+        name, _, value = item.partition("=")
+        try:
+            timings[name] = float(value)
+        except ValueError:
+            continue
+    return timings
+
+
+def strip_timings(text: str) -> str:
+    """
+    Remove the R timings line from a tool result.
+    """
+    return TIMINGS_PATTERN.sub("", text).rstrip("\n")
+
+
+def add_r_spans(timings: Dict[str, float], parent_start_ns: int, parent_end_ns: int):
+    """
+    Add child spans for the steps that the R session timed, one after another.
+
+    The steps start at the time reported by R (clamped to the parent span, in
+    case the R session runs on a machine with a different clock).
+    """
+    steps = {name: seconds for name, seconds in timings.items() if name != "start"}
+    total_ns = int(sum(steps.values()) * 1e9)
+    start_ns = int(timings.get("start", 0) * 1e9)
+    if not parent_start_ns <= start_ns <= parent_end_ns - total_ns:
+        start_ns = max(parent_start_ns, parent_end_ns - total_ns)
+    for name, seconds in steps.items():
+        end_ns = start_ns + int(seconds * 1e9)
+        span = tracer.start_span(f"R {name}", start_time=start_ns)
+        span.end(end_time=end_ns)
+        start_ns = end_ns
+
+
+class TracedSession:
+    """
+    Proxy for an MCP client session that records a span for each tool call.
+
+    Timings reported by the R session are added as child spans and removed from the result.
+    """
+
+    def __init__(self, session):
+        self._session = session
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    async def call_tool(self, name: str, arguments: Optional[Dict[str, Any]] = None, **kwargs):
+        with tracer.start_as_current_span(f"mcp call_tool {name}") as span:
+            span.set_attribute("mcp.tool.name", name)
+            start_ns = time.time_ns()
+            result = await self._session.call_tool(name, arguments, **kwargs)
+            end_ns = time.time_ns()
+            span.set_attribute("mcp.tool.is_error", bool(result.isError))
+            for content in result.content:
+                text = getattr(content, "text", None)
+                if not text:
+                    continue
+                timings = parse_timings(text)
+                if timings is not None:
+                    add_r_spans(timings, start_ns, end_ns)
+                    content.text = strip_timings(text)
+            return result
@@ -0,0 +1,99 @@
+from google.adk.agents.callback_context import CallbackContext
+from typing import Dict, Optional, Tuple
+from .metrics import increment
+from .tracing import add_event
+import hashlib
+import tempfile
+import os
+
+# Directory where uploaded files are saved so the R session can read them
+# (parallel eval workers each use their own directory)
+UPLOAD_DIR = os.environ.get("PLOTMYDATA_UPLOAD_DIR", "/tmp/uploads")
+
+# Artifact versions that have been written, keyed by file path
+# Values are (session ID, artifact version, file size, file modification time)
+_written: Dict[str, Tuple[str, Optional[int], int, int]] = {}
+
+
+def _file_stat(path: str) -> Optional[Tuple[int, int]]:
+    """
+    Get the size and modification time of a file, or None if it doesn't exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _file_sha256(path: str) -> str:
+    """
+    Get the SHA-256 hash of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def materialize_artifact(callback_context: CallbackContext, filename: str) -> str:
+    """
+    Write the latest version of an uploaded artifact to the upload directory.
+
+    Each artifact version is written once. Later calls for the same version
+    skip loading the artifact, and a write is also skipped if the file on disk
+    already has the same content. Files are written atomically so the R session
+    never reads a partly written file. Returns the path of the file.
+    """
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    session_id = callback_context.session.id
+
+    # Get the artifact version without loading its data
+    try:
+        artifact_version = await callback_context.get_artifact_version(filename)
+        version = artifact_version.version if artifact_version else None
+    except NotImplementedError:
+        version = None
+
+    # Skip if this version was already written and the file hasn't changed since then
+    written = _written.get(file_path)
+    if version is not None and written is not None:
+        if written == (session_id, version, *(_file_stat(file_path) or (None, None))):
+            increment("upload_writes_skipped")
+            add_event("upload_skipped", {"path": file_path, "version": version})
+            return file_path
+
+    # Get artifact and byte data
+    artifact = await callback_context.load_artifact(filename=filename)
+    byte_data = artifact.inline_data.data
+
+    # Skip the write if the file already has the same content (e.g. after a restart)
+    stat = _file_stat(file_path)
+    if (
+        stat is not None
+        and stat[0] == len(byte_data)
+        and _file_sha256(file_path) == hashlib.sha256(byte_data).hexdigest()
+    ):
+        increment("upload_writes_skipped")
+        add_event("upload_skipped", {"path": file_path, "bytes": len(byte_data)})
+        print(f"[materialize_artifact] '{file_path}' is up to date")
+    else:
+        # Write to a temporary file then rename it to replace the file atomically
+        with tempfile.NamedTemporaryFile(
+            dir=UPLOAD_DIR, prefix=".upload-", delete=False
+        ) as f:
+            f.write(byte_data)
+        # Set appropriate permissions
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, file_path)
+        increment("upload_writes")
+        add_event(
+            "upload_written",
+            {"path": file_path, "bytes": len(byte_data)},
+        )
+        print(f"[materialize_artifact] Saved artifact as '{file_path}'")
+        stat = _file_stat(file_path)
+
+    _written[file_path] = (session_id, version, *stat)
+    return file_path
@@ -0,0 +1,358 @@
+"""
+Per-phase latency benchmark for the agent pipeline.
+
+Drives root_agent through the evals in an eval CSV file with a scripted model
+in place of the LLM. The script for each eval comes from the tool calls that
+the real model made (the Gen_Tool and Gen_Code columns), so every phase of a
+turn except the LLM itself runs as usual, including the R tools.
+
+Timed phases (p50/p95/p99 in milliseconds):
+  model:<agent>        model call for an agent, including before_model callbacks
+                       (model:Coordinator is the routing step)
+  agent_transfer       from the end of transfer_to_agent until the next agent starts
+  preprocess_artifact  saving uploaded files for the R session
+  mcp_roundtrip        MCP dispatch of a tool that does nothing in R (run_hidden("NULL"))
+  tool:<name>          tool calls (MCP dispatch and evaluation in R)
+  plot_decode          decoding plot data in save_plot_artifact
+  artifact_save        saving plots as artifacts
+  turn                 whole turns
+
+Needs an R session started with profile.R (see run_web.sh).
+
+Usage (from the repository root):
+  python benchmarks/bench_pipeline.py [--csv evals/04/1c3f5bd.csv] [--output results.json]
+  python benchmarks/bench_pipeline.py --compare old.json --output new.json
+"""
+
+from google.adk.agents import BaseAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.plugins.base_plugin import BasePlugin
+from google.adk.plugins.save_files_as_artifacts_plugin import SaveFilesAsArtifactsPlugin
+from google.adk.runners import InMemoryRunner
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.tool_context import ToolContext
+from google.genai import types
+from pathlib import Path
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+import argparse
+import ast
+import asyncio
+import csv
+import glob
+import json
+import mimetypes
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from PlotMyData import metrics
+from PlotMyData.agent import TurnMetricsPlugin, r_server, root_agent
+
+# The agent that has each tool
+TOOL_AGENTS = {
+    "help_package": "Coordinator",
+    "help_topic": "Coordinator",
+    "run_visible": "Run",
+    "run_hidden": "Run",
+    "load_data": "Data",
+    "make_plot": "Plot",
+    "make_ggplot": "Plot",
+}
+
+# Tools whose argument is R code (see run_eval.py)
+CODE_TOOLS = ["run_hidden", "run_visible", "make_plot", "make_ggplot"]
+
+# Stop a scripted eval after this many model calls
+MAX_MODEL_CALLS = 20
+
+
+def parse_tool_calls(gen_tool: str, gen_code: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Get tool calls from the Gen_Tool and Gen_Code columns written by run_eval.py.
+    """
+    tools = [tool.strip() for tool in gen_tool.split(",") if tool.strip()]
+    text = gen_code.replace("\\n", "\n")
+    # Find the "# tool" header of each tool call in order
+    starts = []
+    position = 0
+    for tool in tools:
+        header = f"# {tool}"
+        index = text.find(header, position)
+        while index > 0 and text[index - 2 : index] != "\n\n":
+            index = text.find(header, index + 1)
+        if index < 0:
+            return []
+        starts.append(index)
+        position = index + len(header)
+
+    calls = []
+    for i, tool in enumerate(tools):
+        end = starts[i + 1] - 2 if i + 1 < len(tools) else len(text)
+        body = text[starts[i] + len(f"# {tool}") : end].lstrip("\n")
+        if tool in CODE_TOOLS:
+            args = {"code": body}
+        else:
+            # Other arguments are saved as comments like # 'topic': 'cars'
+            args = {}
+            for line in body.splitlines():
+                key, _, value = line.lstrip("# ").partition(": ")
+                try:
+                    args[ast.literal_eval(key)] = ast.literal_eval(value)
+                except (ValueError, SyntaxError):
+                    continue
+        if tool in TOOL_AGENTS:
+            calls.append((tool, args))
+    return calls
+
+
+class ScriptedLlm(BaseLlm):
+    """
+    Model that makes scripted tool calls instead of calling an LLM.
+
+    If the next tool belongs to another agent, the model transfers to that agent.
+    """
+
+    model: str = "scripted"
+    steps: List[Tuple[str, Dict[str, Any]]] = []
+    calls: int = 0
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        self.calls += 1
+        part = types.Part(text="Done.")
+        while self.steps and self.calls <= MAX_MODEL_CALLS:
+            tool, args = self.steps[0]
+            if tool in llm_request.tools_dict:
+                self.steps.pop(0)
+                part = types.Part(function_call=types.FunctionCall(name=tool, args=args))
+            elif "transfer_to_agent" in llm_request.tools_dict:
+                part = types.Part(
+                    function_call=types.FunctionCall(
+                        name="transfer_to_agent",
+                        args={"agent_name": TOOL_AGENTS[tool]},
+                    )
+                )
+            else:
+                # The tool can't be reached from this agent
+                self.steps.pop(0)
+                continue
+            break
+        yield LlmResponse(content=types.Content(role="model", parts=[part]))
+
+
+class PhaseTimer(BasePlugin):
+    """
+    Plugin that records the time taken by model calls, tool calls and agent transfers.
+    """
+
+    def __init__(self):
+        super().__init__(name="phase_timer")
+        self._model_starts: Dict[str, float] = {}
+        self._tool_starts: Dict[str, float] = {}
+        self._transfer_end: Optional[float] = None
+
+    async def before_agent_callback(
+        self, *, agent: BaseAgent, callback_context: CallbackContext
+    ) -> None:
+        if self._transfer_end is not None:
+            metrics.record_time("agent_transfer", time.perf_counter() - self._transfer_end)
+            self._transfer_end = None
+
+    async def before_model_callback(
+        self, *, callback_context: CallbackContext, llm_request: LlmRequest
+    ) -> None:
+        self._model_starts[callback_context.agent_name] = time.perf_counter()
+
+    async def after_model_callback(
+        self, *, callback_context: CallbackContext, llm_response: LlmResponse
+    ) -> None:
+        start = self._model_starts.pop(callback_context.agent_name, None)
+        if start is not None:
+            metrics.record_time(
+                f"model:{callback_context.agent_name}", time.perf_counter() - start
+            )
+
+    async def before_tool_callback(
+        self, *, tool: BaseTool, tool_args: Dict[str, Any], tool_context: ToolContext
+    ) -> None:
+        self._tool_starts[tool_context.function_call_id] = time.perf_counter()
+
+    async def after_tool_callback(
+        self,
+        *,
+        tool: BaseTool,
+        tool_args: Dict[str, Any],
+        tool_context: ToolContext,
+        result: Dict,
+    ) -> None:
+        start = self._tool_starts.pop(tool_context.function_call_id, None)
+        now = time.perf_counter()
+        if start is not None:
+            metrics.record_time(f"tool:{tool.name}", now - start)
+        if tool.name == "transfer_to_agent":
+            self._transfer_end = now
+
+
+def read_evals(csv_file: str) -> List[Dict[str, str]]:
+    """
+    Read evals that have a query and recorded tool calls.
+    """
+    with open(csv_file, encoding="utf-8") as f:
+        return [
+            row
+            for row in csv.DictReader(f)
+            if row.get("Query", "").strip() and row.get("Gen_Tool", "").strip()
+        ]
+
+
+def user_message(row: Dict[str, str]) -> types.Content:
+    """
+    Make the user message for an eval, attaching the data file if there is one.
+    """
+    parts = [types.Part(text=row["Query"])]
+    file_name = (row.get("File") or "").strip()
+    file_path = os.path.join("evals", "data", file_name)
+    if file_name and os.path.exists(file_path):
+        with open(file_path, "rb") as f:
+            data = f.read()
+        mime_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        parts.append(
+            types.Part(
+                inline_data=types.Blob(data=data, mime_type=mime_type, display_name=file_name)
+            )
+        )
+    return types.Content(role="user", parts=parts)
+
+
+async def time_mcp_roundtrip(n: int = 50):
+    """
+    Time MCP calls of a tool that does almost nothing in R.
+    """
+    session = await r_server.create_session()
+    for _ in range(n):
+        with metrics.timed("mcp_roundtrip"):
+            await session.call_tool("run_hidden", {"code": "NULL"})
+
+
+def use_model(agent: BaseAgent, model: BaseLlm):
+    """
+    Use a model for an agent and its sub-agents.
+    """
+    agent.model = model
+    for sub_agent in agent.sub_agents:
+        use_model(sub_agent, model)
+
+
+async def run_benchmark(rows: List[Dict[str, str]]):
+    metrics.reset()
+    model = ScriptedLlm()
+    use_model(root_agent, model)
+    runner = InMemoryRunner(
+        agent=root_agent,
+        plugins=[SaveFilesAsArtifactsPlugin(), TurnMetricsPlugin(), PhaseTimer()],
+    )
+    await time_mcp_roundtrip()
+    for row in rows:
+        model.steps = parse_tool_calls(row["Gen_Tool"], row["Gen_Code"])
+        model.calls = 0
+        session = await runner.session_service.create_session(
+            app_name=runner.app_name, user_id="bench_user"
+        )
+        try:
+            async for _ in runner.run_async(
+                user_id=session.user_id,
+                session_id=session.id,
+                new_message=user_message(row),
+            ):
+                pass
+        except Exception as e:
+            metrics.increment("eval_errors")
+            print(f"Eval {row['Number']} failed: {e}", file=sys.stderr)
+        print(f"Eval {row['Number']} done")
+    await runner.close()
+
+
+def results_table(stats: Dict[str, Dict], old: Optional[Dict[str, Dict]] = None) -> str:
+    """
+    Format timing statistics, with the change in p50 from old results if given.
+    """
+    lines = [f"{'name':<24} {'count':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}"]
+    if old is not None:
+        lines[0] += f" {'p50 change':>11}"
+    for name in sorted(stats):
+        s = stats[name]
+        line = f"{name:<24} {s['count']:>6} {s['median_ms']:>10.2f} {s['p95_ms']:>10.2f} {s['p99_ms']:>10.2f}"
+        if old is not None:
+            if name in old and old[name]["median_ms"] > 0:
+                change = s["median_ms"] / old[name]["median_ms"] - 1
+                line += f" {change:>+10.0%}"
+            else:
+                line += f" {'new':>11}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def default_csv() -> str:
+    """
+    Get evals/evals.csv or else the most recent eval CSV file.
+    """
+    if os.path.exists(os.path.join("evals", "evals.csv")):
+        return os.path.join("evals", "evals.csv")
+    # Eval sets are numbered; the newest file in the last set has the latest results
+    files = sorted(glob.glob(os.path.join("evals", "[0-9]*", "*.csv")))
+    last_set = os.path.dirname(files[-1])
+    return max(
+        (f for f in files if os.path.dirname(f) == last_set), key=os.path.getmtime
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--csv", default=None, help="eval CSV file with recorded tool calls")
+    parser.add_argument("--limit", type=int, help="run only the first LIMIT evals")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results from an earlier run to compare with")
+    args = parser.parse_args()
+
+    csv_file = args.csv or default_csv()
+    rows = read_evals(csv_file)[: args.limit]
+    asyncio.run(run_benchmark(rows))
+
+    summary = metrics.summary()
+    tools = {k: v for k, v in summary["timings"].items() if k.startswith("tool:")}
+    phases = {k: v for k, v in summary["timings"].items() if not k.startswith("tool:")}
+    commit = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+    ).stdout.strip()
+    results = {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "csv": csv_file,
+        "evals": len(rows),
+        "phases": phases,
+        "tools": tools,
+        "counters": summary["counters"],
+    }
+
+    old = None
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print(f"Compared with {old.get('commit')} ({args.compare})")
+    print(f"\nPhases ({len(rows)} evals from {csv_file}, commit {commit})")
+    print(results_table(phases, old and old["phases"]))
+    print("\nTools")
+    print(results_table(tools, old and old["tools"]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Microbenchmark for the preprocess_messages callback.
+
+Simulates sessions that grow to hundreds of events and times a model call with one new event.
+The original callback read the last part of every request content on every call.
+The current callback keeps the ID of the last checked event in session state
+and only checks newer events, so its cost doesn't grow with the session.
+
+Usage (from the repository root): python benchmarks/bench_preprocess_messages.py
+"""
+
+from google.adk.events import Event
+from google.adk.models import LlmRequest
+from google.genai import types
+from types import SimpleNamespace
+from pathlib import Path
+import asyncio
+import copy
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from PlotMyData.agent import CHECKED_EVENT_KEY, preprocess_messages
+
+
+async def preprocess_messages_full_scan(callback_context, llm_request):
+    """
+    The original callback, which rewrites markers in all request contents on every call.
+    """
+    for i in range(len(llm_request.contents)):
+        user_message = llm_request.contents[i].parts[-1].text
+        if user_message:
+            if '[Uploaded Artifact: "' in user_message:
+                user_message = user_message.replace(
+                    '[Uploaded Artifact: "', '[Uploaded File: "/tmp/uploads/'
+                )
+                llm_request.contents[i].parts[-1].text = user_message
+    return None
+
+
+def make_event(i: int) -> Event:
+    """
+    Make a session event; every 20th event is a user message with an uploaded file.
+    """
+    if i % 20 == 0:
+        text = f'Plot the data\n[Uploaded Artifact: "data-{i}.csv"]'
+        role, author = "user", "user"
+    else:
+        text = f"Response {i}: " + "x" * 200
+        role, author = "model", "Coordinator"
+    content = types.Content(role=role, parts=[types.Part(text=text)])
+    return Event(author=author, content=content)
+
+
+async def time_session(callback, n_events: int, session_id: str) -> float:
+    """
+    Grow a session to n_events and return the callback time (microseconds) for a model call with one new event.
+    """
+    session = SimpleNamespace(id=session_id, events=[])
+    callback_context = SimpleNamespace(session=session, state={})
+    for i in range(n_events):
+        session.events.append(make_event(i))
+        # As in ADK, each request is built from copies of the session events
+        contents = [copy.deepcopy(event.content) for event in session.events]
+        llm_request = LlmRequest(contents=contents)
+        await callback(callback_context, llm_request)
+    # Time the last call again (best of several runs): the newest event hasn't been checked yet
+    times = []
+    for _ in range(50):
+        callback_context.state[CHECKED_EVENT_KEY] = session.events[-2].id
+        start = time.perf_counter()
+        await callback(callback_context, llm_request)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1e6
+
+
+async def main():
+    print(f"{'events':>8} {'full scan (us)':>16} {'new events (us)':>20}")
+    for n_events in [10, 50, 100, 200, 500]:
+        full = await time_session(
+            preprocess_messages_full_scan, n_events, f"full-{n_events}"
+        )
+        current = await time_session(
+            preprocess_messages, n_events, f"current-{n_events}"
+        )
+        print(f"{n_events:>8} {full:>16.1f} {current:>20.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
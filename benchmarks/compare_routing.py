@@ -0,0 +1,152 @@
+"""
+Compare the rule-based pre-router with the routing chosen by the model in evals.
+
+For each eval, the query (with the text added for an uploaded file) is routed
+with route_message() from PlotMyData/routing.py. When a rule matches, its agent
+is compared with the agent that made the first tool call in the eval results
+(the Gen_Tool column). If the model called a help tool first, the Coordinator
+handled the request itself, so a rule that transfers right away disagrees.
+
+Evals start with an empty R session, so no data is loaded when they are routed,
+and few of them match a rule. The requests in benchmarks/routing_evals.csv
+exercise each rule (uploads without a plot request, "install X", and plots of
+data loaded in an earlier turn) and requests that no rule should match. Each
+has the agent that should handle it (Agent) and the rule that should match
+(Rule, empty for none).
+
+Usage (from the repository root):
+  python benchmarks/compare_routing.py [evals/04/1c3f5bd.csv ...]
+
+Exits with status 1 if any routed eval disagrees with the model or the expected
+agent, or if a rule matches a request in routing_evals.csv that it shouldn't
+(or misses one it should).
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+import argparse
+import csv
+import glob
+import os
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from PlotMyData.routing import route_message
+
+# Requests with the expected agent and rule
+RULE_EVALS = Path(__file__).resolve().parent / "routing_evals.csv"
+
+# Agents that have each tool (see tool_filter in agent.py)
+TOOL_AGENTS: Dict[str, Set[str]] = {
+    "help_package": {"Coordinator"},
+    "help_topic": {"Coordinator"},
+    "run_visible": {"Run", "Data", "Install"},
+    "run_hidden": {"Run"},
+    "get_output": {"Run"},
+    "submit_job": {"Run"},
+    "job_status": {"Run", "Plot"},
+    "job_result": {"Run", "Plot"},
+    "load_data": {"Data"},
+    "make_plot": {"Plot"},
+    "make_ggplot": {"Plot"},
+}
+
+
+def model_agents(gen_tool: str) -> Optional[Set[str]]:
+    """
+    Get the agents that could have made the first tool call, or None if there were no tool calls.
+    """
+    tools = [tool.strip() for tool in gen_tool.split(",") if tool.strip()]
+    if not tools:
+        return None
+    return TOOL_AGENTS.get(tools[0], set())
+
+
+def query_text(row: Dict[str, str]) -> str:
+    """
+    Get the user message for an eval, with the text added for an uploaded file (see preprocess_messages() in agent.py).
+    """
+    text = row["Query"]
+    if row.get("File", "").strip():
+        text += f'\n[Uploaded File: "/tmp/uploads/{row["File"].strip()}"]'
+    return text
+
+
+def compare(csv_file: str) -> int:
+    """
+    Print the comparison for one eval results file and return the number of disagreements.
+    """
+    with open(csv_file, encoding="utf-8") as f:
+        rows = [row for row in csv.DictReader(f) if row.get("Query", "").strip()]
+    hits = agree = 0
+    disagreements: List[str] = []
+    for row in rows:
+        route = route_message(query_text(row), data_loaded=False)
+        if route is None:
+            continue
+        hits += 1
+        agent, rule = route
+        expected = model_agents(row.get("Gen_Tool", ""))
+        if expected is None or agent in expected:
+            agree += 1
+        else:
+            disagreements.append(
+                f"  eval {row['Number']}: {rule} -> {agent}, model -> {'/'.join(sorted(expected))}: {row['Query'][:60]}"
+            )
+    print(
+        f"{csv_file}: {len(rows)} evals, {hits} routed by rules ({hits / max(1, len(rows)):.0%}), "
+        f"{agree} agree, {len(disagreements)} disagree"
+    )
+    for line in disagreements:
+        print(line)
+    return len(disagreements)
+
+
+def compare_rules(csv_file: str = str(RULE_EVALS)) -> int:
+    """
+    Print the agreement of the rules with the expected agents and rules and return the number of errors.
+    """
+    with open(csv_file, encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    # Number of requests expected for each rule, routed by it, and routed to the expected agent
+    counts: Dict[str, List[int]] = {}
+    errors: List[str] = []
+    for row in rows:
+        route = route_message(query_text(row), data_loaded=row["Data_Loaded"] == "True")
+        expected_rule = row["Rule"].strip()
+        if expected_rule:
+            counts.setdefault(expected_rule, [0, 0, 0])[0] += 1
+        if route is None:
+            if expected_rule:
+                errors.append(f"  eval {row['Number']}: {expected_rule} didn't match: {row['Query'][:60]}")
+            continue
+        agent, rule = route
+        counts.setdefault(rule, [0, 0, 0])[1] += 1
+        if agent == row["Agent"]:
+            counts[rule][2] += 1
+        if rule != expected_rule or agent != row["Agent"]:
+            errors.append(
+                f"  eval {row['Number']}: {rule} -> {agent}, expected {expected_rule or 'no rule'} -> {row['Agent']}: {row['Query'][:60]}"
+            )
+    routed = sum(count[1] for count in counts.values())
+    agree = sum(count[2] for count in counts.values())
+    print(
+        f"{os.path.relpath(csv_file)}: {len(rows)} requests, {routed} routed by rules, "
+        f"{agree} agree with the expected agent, {len(errors)} errors"
+    )
+    for rule, (expected, routed, agree) in sorted(counts.items()):
+        print(f"  {rule}: {expected} expected, {routed} routed, {agree} agree")
+    for line in errors:
+        print(line)
+    return len(errors)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "csv_files", nargs="*", help="eval results files (default: evals/[0-9]*/*.csv)"
+    )
+    args = parser.parse_args()
+    csv_files = args.csv_files or sorted(glob.glob("evals/[0-9]*/*.csv"))
+    total = sum(compare(csv_file) for csv_file in csv_files) + compare_rules()
+    sys.exit(1 if total else 0)
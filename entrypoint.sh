@@ -6,10 +6,11 @@ set -e
 # Use profile for persistent R session
 cp profile.R .Rprofile
 
-# Start R in a detached screen session
 # TODO: Look at using supervisord for another way to run multiple services
 # https://docs.docker.com/engine/containers/multi-service_container/#use-a-process-manager
-screen -d -m R
+# Start a pool of R sessions (R_POOL_SIZE, default 1) in detached screen sessions
+. ./r_sessions.sh
+start_r_sessions
 
 # Activate virtual environment
 export PATH="/opt/venv/bin:$PATH"
@@ -0,0 +1,140 @@
+"""
+Start and stop interactive R sessions for parallel evals and the web UI.
+
+Each R session runs in a detached tmux or screen session and loads profile.R
+(copied to .Rprofile), which makes the session visible to the MCP server with
+mcptools::mcp_session() and then writes the R process ID to a ready file.
+
+mcptools numbers R sessions in the order they start, and the MCP server selects
+a session by its number (see the R_SESSION environment variable in agent.py).
+Sessions are therefore started one at a time, and a session is restarted only
+while all the others are running, so that session k keeps number k. This
+assumes that no other R sessions on the machine have run mcp_session().
+
+The web UI starts its sessions with screen (see r_sessions.sh), and the agent
+uses RSessions with the same ready files to restart a session that stopped.
+"""
+
+from typing import Dict, Optional
+import asyncio
+import os
+import shlex
+import signal
+import tempfile
+import time
+
+
+class RSessions:
+    """
+    Numbered R sessions, each running in a tmux or screen session named R-session-<number>.
+    """
+
+    def __init__(
+        self,
+        startup_timeout: float = 120.0,
+        shutdown_timeout: float = 10.0,
+        multiplexer: str = "tmux",
+        ready_file_pattern: Optional[str] = None,
+    ):
+        if multiplexer not in ("tmux", "screen"):
+            raise ValueError(f"Unknown terminal multiplexer: {multiplexer}")
+        self.multiplexer = multiplexer
+        self.startup_timeout = startup_timeout
+        self.shutdown_timeout = shutdown_timeout
+        # R process IDs, keyed by session number
+        self._pids: Dict[int, int] = {}
+        # Only one session is started or stopped at a time
+        self._lock = asyncio.Lock()
+        # Ready file of each session (formatted with the session number); it holds the R process ID
+        if ready_file_pattern is None:
+            ready_file_pattern = os.path.join(tempfile.mkdtemp(prefix="plotmydata-r-"), "{}.pid")
+        self.ready_file_pattern = ready_file_pattern
+
+    async def start(self, number: int):
+        """
+        Start R session number `number` and wait until it is ready.
+        """
+        async with self._lock:
+            await self._start(number)
+
+    async def restart(self, number: int):
+        """
+        Replace R session number `number` with a new session (with an empty workspace).
+        """
+        async with self._lock:
+            await self._stop(number)
+            await self._start(number)
+
+    async def stop_all(self):
+        """
+        Stop all R sessions.
+        """
+        async with self._lock:
+            for number in sorted(self._pids, reverse=True):
+                await self._stop(number)
+
+    async def _run(self, *args: str) -> int:
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        return await process.wait()
+
+    async def _start(self, number: int):
+        ready_file = self.ready_file_pattern.format(number)
+        if os.path.exists(ready_file):
+            os.remove(ready_file)
+        # The command runs in a shell, so the environment variable is set for R only
+        command = f"PLOTMYDATA_READY_FILE={shlex.quote(ready_file)} R"
+        name = f"R-session-{number}"
+        if self.multiplexer == "screen":
+            args = ("screen", "-d", "-m", "-S", name, "sh", "-c", command)
+        else:
+            args = ("tmux", "new-session", "-d", "-s", name, command)
+        if await self._run(*args):
+            raise RuntimeError(f"Couldn't start {self.multiplexer} session for R session {number}")
+
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            if os.path.exists(ready_file):
+                with open(ready_file) as f:
+                    pid = f.read().strip()
+                if pid:
+                    break
+            if time.monotonic() > deadline:
+                raise TimeoutError(
+                    f"R session {number} wasn't ready after {self.startup_timeout} s"
+                )
+            await asyncio.sleep(0.2)
+        self._pids[number] = int(pid)
+        print(f"[RSessions] R session {number} started (pid {pid})")
+
+    async def _stop(self, number: int):
+        pid = self._pids.pop(number, None)
+        if pid is None:
+            # The session may have been started by another process (e.g. r_sessions.sh)
+            try:
+                with open(self.ready_file_pattern.format(number)) as f:
+                    pid = int(f.read().strip())
+            except (OSError, ValueError):
+                pass
+        name = f"R-session-{number}"
+        if self.multiplexer == "screen":
+            await self._run("screen", "-X", "-S", name, "quit")
+        else:
+            await self._run("tmux", "kill-session", "-t", name)
+        if pid is None:
+            return
+        # Wait for R to exit so that its session number is free for the next session
+        deadline = time.monotonic() + self.shutdown_timeout
+        while True:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                break
+            if time.monotonic() > deadline:
+                os.kill(pid, signal.SIGKILL)
+                deadline = float("inf")
+            await asyncio.sleep(0.1)
+        print(f"[RSessions] R session {number} stopped")
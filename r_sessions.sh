@@ -0,0 +1,38 @@
+# Start and stop the pool of R sessions for the web UI (sourced by entrypoint.sh and run_web.sh)
+
+# mcptools socket isn't visible in Docker container with tmux; use screen instead
+# Each R session runs in a detached screen session named R-session-<number> and writes its
+# process ID to a ready file after running mcp_session() (see profile.R).
+# The agent uses the ready file to interrupt R code that runs past its time limit, and
+# restarts an R session that stops with the same screen command (see r_sessions.py).
+export R_POOL_SIZE=${R_POOL_SIZE:-1}
+export PLOTMYDATA_READY_FILE_PATTERN="/tmp/plotmydata-R-session-{}.pid"
+export PLOTMYDATA_R_MULTIPLEXER=screen
+
+# Start R_POOL_SIZE R sessions (default 1)
+# Sessions are started one at a time so that mcptools numbers them 1, 2, ...
+start_r_sessions() {
+  i=1
+  while [ "$i" -le "$R_POOL_SIZE" ]; do
+    READY_FILE="/tmp/plotmydata-R-session-$i.pid"
+    rm -f "$READY_FILE"
+    PLOTMYDATA_READY_FILE="$READY_FILE" screen -d -m -S "R-session-$i" R
+    # Wait up to 2 minutes for the session to be ready
+    tries=0
+    while [ ! -s "$READY_FILE" ] && [ "$tries" -lt 600 ]; do
+      sleep 0.2
+      tries=$((tries + 1))
+    done
+    [ -s "$READY_FILE" ] || echo "Warning: R session $i didn't start"
+    i=$((i + 1))
+  done
+}
+
+# Stop the R sessions
+stop_r_sessions() {
+  i=1
+  while [ "$i" -le "$R_POOL_SIZE" ]; do
+    screen -X -S "R-session-$i" quit
+    i=$((i + 1))
+  done
+}
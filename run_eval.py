@@ -1,15 +1,22 @@
 from google.adk.plugins.save_files_as_artifacts_plugin import SaveFilesAsArtifactsPlugin
 from google.adk.runners import InMemoryRunner
 from google.genai import types as genai_types
-from PlotMyData.agent import root_agent
+from PlotMyData.agent import TurnMetricsPlugin, root_agent
+from PlotMyData.uploads import UPLOAD_DIR
+from r_sessions import RSessions
+from collections import deque
 from datetime import datetime
 from pathlib import Path
+from typing import Dict, List, Tuple
+import argparse
 import asyncio
 import json
 import csv
 import sys
 import os
 import mimetypes
+import shutil
+import tempfile
 
 
 async def run_eval(
@@ -281,10 +288,12 @@ def get_query_and_file_from_csv(eval_number: int, csv_file: str) -> tuple[str, s
     raise ValueError(f"Eval number {eval_number} not found in {csv_file}")
 
 
-def update_csv_results(
-    csv_file: str, eval_number: int, tool_calls: list, gen_code: list
-):
-    """Update the CSV file with eval results."""
+def update_csv_results(csv_file: str, results: Dict[int, Tuple[list, list]]):
+    """Update the CSV file with eval results.
+
+    results maps eval numbers to (tool_calls, gen_code). All results are written
+    in one pass, so the rows stay in the same order however the evals were run.
+    """
     try:
         # Read all rows
         rows = []
@@ -294,10 +303,13 @@ def update_csv_results(
             for row in reader:
                 rows.append(row)
 
-        # Update the row for this eval number
+        # Update the rows for these eval numbers
         for row in rows:
             try:
-                if int(row["Number"]) == eval_number:
+                eval_number = int(row["Number"])
+                if eval_number in results:
+                    tool_calls, gen_code = results[eval_number]
+
                     # Update Date column
                     row["Date"] = datetime.now().strftime("%Y-%m-%d")
 
@@ -308,7 +320,6 @@ def update_csv_results(
                     # Update Gen_Code column - convert newlines to escape sequences
                     gen_code_str = "\n\n".join(gen_code).replace("\n", "\\n")
                     row["Gen_Code"] = gen_code_str
-                    break
             except (ValueError, KeyError):
                 continue
 
@@ -318,21 +329,121 @@ def update_csv_results(
             writer.writeheader()
             writer.writerows(rows)
 
-        print(f"CSV updated with results for eval {eval_number}")
+        numbers = ", ".join(str(number) for number in sorted(results))
+        print(f"CSV updated with results for eval {numbers}")
     except Exception as e:
         print(f"Error updating CSV: {e}", file=sys.stderr)
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print(f"Usage: {sys.argv[0]} <eval_number>", file=sys.stderr)
-        sys.exit(1)
+def parse_eval_numbers(spec: str, csv_file: str) -> List[int]:
+    """Get eval numbers from a spec like "3", "1-5,8" or "all" (every eval with a query)."""
+    if spec == "all":
+        numbers = []
+        with open(csv_file, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    if row.get("Query", "").strip():
+                        numbers.append(int(row["Number"]))
+                except (ValueError, KeyError):
+                    continue
+        return sorted(set(numbers))
+
+    numbers = []
+    for part in spec.split(","):
+        part = part.strip()
+        if "-" in part:
+            start, end = part.split("-", 1)
+            numbers.extend(range(int(start), int(end) + 1))
+        else:
+            numbers.append(int(part))
+    return sorted(set(numbers))
 
+
+async def run_batch(
+    eval_numbers: List[int], workers: int, csv_file: str, session_dir: str
+) -> int:
+    """
+    Run evals in parallel and merge the results into the CSV file.
+
+    Each worker has its own R session and upload directory. A worker runs one
+    eval at a time in a subprocess, and its R session is restarted before each
+    eval so that no workspace state is shared between evals. The output of each
+    eval is saved in the session directory (e.g. 001.log).
+
+    Returns the number of evals that failed.
+    """
+    queue = deque(eval_numbers)
+    results: Dict[int, Tuple[list, list]] = {}
+    failed = []
+    results_dir = tempfile.mkdtemp(prefix="plotmydata-evals-")
+    r_sessions = RSessions()
+
+    async def worker(number: int):
+        env = dict(
+            os.environ,
+            R_SESSION=str(number),
+            PLOTMYDATA_UPLOAD_DIR=f"{UPLOAD_DIR}-{number}",
+            # Used to interrupt R code that runs past its time limit
+            PLOTMYDATA_READY_FILE_PATTERN=r_sessions.ready_file_pattern,
+        )
+        while queue:
+            eval_number = queue.popleft()
+            eval_str = f"{eval_number:03d}"
+            results_file = os.path.join(results_dir, f"{eval_str}.json")
+            await r_sessions.restart(number)
+            print(f"[worker {number}] Running eval {eval_number}")
+            with open(os.path.join(session_dir, f"{eval_str}.log"), "w") as log:
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable,
+                    __file__,
+                    str(eval_number),
+                    "--results-file",
+                    results_file,
+                    env=env,
+                    stdout=log,
+                    stderr=asyncio.subprocess.STDOUT,
+                )
+                exit_code = await process.wait()
+            print(f"[worker {number}] Eval {eval_number} exited with code {exit_code}")
+            if exit_code == 0 and os.path.exists(results_file):
+                with open(results_file, encoding="utf-8") as f:
+                    result = json.load(f)
+                results[eval_number] = (result["tool_calls"], result["gen_code"])
+            else:
+                failed.append(eval_number)
+
+    # Use profile for persistent R sessions
+    shutil.copy("profile.R", ".Rprofile")
     try:
-        eval_number = int(sys.argv[1])
-    except ValueError:
-        print(f"Error: Invalid eval number: {sys.argv[1]}", file=sys.stderr)
-        sys.exit(1)
+        # Start the sessions in order so each worker's session has its own number
+        for number in range(1, workers + 1):
+            await r_sessions.start(number)
+        await asyncio.gather(*(worker(number) for number in range(1, workers + 1)))
+    finally:
+        await r_sessions.stop_all()
+        os.remove(".Rprofile")
+        shutil.rmtree(results_dir, ignore_errors=True)
+
+    if results:
+        update_csv_results(csv_file, results)
+    if failed:
+        print(f"Failed evals: {', '.join(str(n) for n in sorted(failed))}")
+    return len(failed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run evals from evals/evals.csv")
+    parser.add_argument(
+        "evals", help='eval number, list of numbers and ranges (e.g. "1-5,8"), or "all"'
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="run evals in parallel with this many workers, each with its own R session",
+    )
+    # Used by batch workers to return results instead of updating the CSV file
+    parser.add_argument("--results-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
 
     # Get paths
     csv_file = os.path.join("evals", "evals.csv")
@@ -343,6 +454,21 @@ if __name__ == "__main__":
     Path(session_dir).mkdir(parents=True, exist_ok=True)
     Path(generated_dir).mkdir(parents=True, exist_ok=True)
 
+    try:
+        eval_numbers = parse_eval_numbers(args.evals, csv_file)
+    except ValueError:
+        print(f"Error: Invalid eval number or range: {args.evals}", file=sys.stderr)
+        sys.exit(1)
+
+    # Batch mode: the runner starts its own R sessions
+    if args.workers is not None or len(eval_numbers) != 1:
+        workers = max(1, min(args.workers or 1, len(eval_numbers)))
+        sys.exit(
+            1 if asyncio.run(run_batch(eval_numbers, workers, csv_file, session_dir)) else 0
+        )
+
+    eval_number = eval_numbers[0]
+
     # Read query and optional file from CSV
     try:
         query, file_name = get_query_and_file_from_csv(eval_number, csv_file)
@@ -361,12 +487,20 @@ if __name__ == "__main__":
         eval_file = file_name.strip()
 
     # Create a runner instance
-    runner = InMemoryRunner(agent=root_agent, plugins=[SaveFilesAsArtifactsPlugin()])
+    runner = InMemoryRunner(
+        agent=root_agent, plugins=[SaveFilesAsArtifactsPlugin(), TurnMetricsPlugin()]
+    )
     # Start the asynchronous event loop and run the eval
     exit_code, tool_calls, gen_code = asyncio.run(
         run_eval(runner, eval_number, eval_file, query, session_dir, generated_dir)
     )
-    # Update CSV with results
-    update_csv_results(csv_file, eval_number, tool_calls, gen_code)
+    if args.results_file:
+        # Return results to the batch runner, which updates the CSV file
+        if exit_code == 0:
+            with open(args.results_file, "w", encoding="utf-8") as f:
+                json.dump({"tool_calls": tool_calls, "gen_code": gen_code}, f)
+    else:
+        # Update CSV with results
+        update_csv_results(csv_file, {eval_number: (tool_calls, gen_code)})
 
     sys.exit(exit_code)
@@ -1,39 +1,61 @@
 #!/bin/sh
 
 # Check if eval number is provided
-if [ "$#" -ne 1 ]; then
+if [ "$#" -lt 1 ] || [ "$#" -gt 2 ]; then
   echo "Usage: $0 <eval_number>"
+  echo "       $0 <eval_numbers_and_ranges (e.g. 1-5,8) | all> [workers]"
   exit 1
 fi
 
 EVAL_NUMBER="$1"
 
+# Suppress e.g. UserWarning: [EXPERIMENTAL] BaseAuthenticatedTool: This feature is experimental ...
+# https://github.com/google/adk-python/commit/4afc9b2f33d63381583cea328f97c02213611529
+export ADK_SUPPRESS_EXPERIMENTAL_FEATURE_WARNINGS=true
+
+# Define the model
+export OPENAI_MODEL_NAME=gpt-4o
+
+# Run several evals in parallel; the Python script starts an R session for each worker
+case "$EVAL_NUMBER" in
+  *[!0-9]*|"")
+    OPENAI_API_KEY=`cat secret.openai-api-key` exec python3 run_eval.py "$EVAL_NUMBER" --workers "${2:-1}"
+    ;;
+esac
+
 # Use profile for persistent R session
 cp profile.R .Rprofile
 
+# The R session writes its process ID to the ready file after running mcp_session() (see profile.R);
+# the agent reads it to interrupt R code that runs past its time limit
+export PLOTMYDATA_READY_FILE_PATTERN="/tmp/plotmydata-R-session-{}.pid"
+READY_FILE="/tmp/plotmydata-R-session-1.pid"
+rm -f "$READY_FILE"
+
 # Start R in a detached tmux session named R-session
 # https://stackoverflow.com/questions/33426159/starting-a-new-tmux-session-and-detaching-it-all-inside-a-shell-script
-tmux new-session -d -s R-session "R"
+# tmux runs the command with a shell, so the environment variable is set for R only
+tmux new-session -d -s R-session "PLOTMYDATA_READY_FILE=$READY_FILE R"
+# Wait up to 2 minutes for the session to be ready
+tries=0
+while [ ! -s "$READY_FILE" ] && [ "$tries" -lt 600 ]; do
+  sleep 0.2
+  tries=$((tries + 1))
+done
+[ -s "$READY_FILE" ] || echo "Warning: R session didn't start"
 
 # Define a cleanup function
 cleanup() {
   echo "Script is being terminated. Cleaning up..."
   # Kill the R session
   tmux kill-session -t R-session
-  # Remove the profile file
-  rm .Rprofile
+  # Remove the profile and ready files
+  rm -f .Rprofile "$READY_FILE"
 }
 
 # Set the trap to call cleanup on script termination
 trap cleanup SIGINT SIGTERM
 
-# Suppress e.g. UserWarning: [EXPERIMENTAL] BaseAuthenticatedTool: This feature is experimental ...
-# https://github.com/google/adk-python/commit/4afc9b2f33d63381583cea328f97c02213611529
-export ADK_SUPPRESS_EXPERIMENTAL_FEATURE_WARNINGS=true
-
-# Define the model
-export OPENAI_MODEL_NAME=gpt-4o
-
 # Run the eval using Python script
 # The Python script will read the prompt from evals.csv and run ADK
 OPENAI_API_KEY=`cat secret.openai-api-key` python3 run_eval.py "$EVAL_NUMBER"
@@ -7,15 +7,16 @@ cp profile.R .Rprofile
 # https://stackoverflow.com/questions/33426159/starting-a-new-tmux-session-and-detaching-it-all-inside-a-shell-script
 #tmux new-session -d -s R-session "R"
 
-# mcptools socket isn't visible in Docker container with tmux; use screen instead
-screen -d -m -S R-session R
+# Start a pool of R sessions (R_POOL_SIZE, default 1) in detached screen sessions
+. ./r_sessions.sh
+start_r_sessions
 
 # Define a cleanup function
 cleanup() {
   echo "Script is being terminated. Cleaning up..."
-  # Kill the R session
+  # Kill the R sessions
   #tmux kill-session -t R-session
-  screen -X -S R-session quit
+  stop_r_sessions
   # Remove the profile file
   rm .Rprofile
 }
@@ -0,0 +1,50 @@
+"""
+Tests for the cache modes of CachedLlm.
+
+Usage (from the repository root): python -m pytest tests/test_llm_cache.py
+"""
+
+from google.adk.models import LlmRequest, LlmResponse
+from google.adk.models.lite_llm import LiteLlm
+from google.genai import types
+from pathlib import Path
+import asyncio
+import pytest
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from PlotMyData.llm_cache import CachedLlm, LlmCacheMiss
+
+
+def generate(model: CachedLlm) -> str:
+    """
+    Send a request and get the text of the response.
+    """
+    llm_request = LlmRequest(contents=[types.Content(role="user", parts=[types.Part(text="Hello")])])
+
+    async def responses():
+        return [response async for response in model.generate_content_async(llm_request)]
+
+    return "".join(response.content.parts[0].text for response in asyncio.run(responses()))
+
+
+def test_cache_modes(tmp_path, monkeypatch):
+    calls = []
+
+    async def generate_content_async(self, llm_request, stream=False):
+        calls.append(llm_request)
+        yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=f"Answer {len(calls)}")]))
+
+    monkeypatch.setattr(LiteLlm, "generate_content_async", generate_content_async)
+    model = lambda mode: CachedLlm(model="test", cache_mode=mode, cache_dir=str(tmp_path))
+
+    with pytest.raises(LlmCacheMiss):
+        generate(model("replay"))
+    # Update mode records a missing response and then uses it
+    assert generate(model("update")) == "Answer 1"
+    assert generate(model("update")) == "Answer 1"
+    # Record mode always calls the model and replaces the stored response
+    assert generate(model("record")) == "Answer 2"
+    assert generate(model("record")) == "Answer 3"
+    assert generate(model("replay")) == "Answer 3"
+    assert len(calls) == 3
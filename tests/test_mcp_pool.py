@@ -0,0 +1,72 @@
+"""
+Tests for closing the shared McpSessionPool.
+
+Usage (from the repository root): python -m pytest tests/test_mcp_pool.py
+"""
+
+from google.adk.tools.mcp_tool.mcp_session_manager import StdioConnectionParams
+from mcp import StdioServerParameters
+from pathlib import Path
+import asyncio
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from PlotMyData.mcp_pool import McpSessionPool, PooledMcpToolset
+
+
+def make_pool():
+    """
+    Make a pool that counts how many times it is closed.
+    """
+    params = StdioConnectionParams(server_params=StdioServerParameters(command="Rscript", args=["server.R"]))
+    pool = McpSessionPool(params)
+    pool.closes = 0
+
+    async def close():
+        pool.closes += 1
+
+    pool.close = close
+    return pool
+
+
+def test_pool_is_closed_after_the_last_toolset():
+    pool = make_pool()
+    toolsets = [PooledMcpToolset(session_pool=pool, tool_filter=[name]) for name in ["run_visible", "make_plot"]]
+
+    async def close_all():
+        await toolsets[0].close()
+        assert pool.closes == 0
+        # Closing a toolset again doesn't close the pool for the others
+        await toolsets[0].close()
+        assert pool.closes == 0
+        await toolsets[1].close()
+        assert pool.closes == 1
+
+    asyncio.run(close_all())
+
+
+def test_toolset_used_after_close_is_counted_again():
+    pool = make_pool()
+    toolset = PooledMcpToolset(session_pool=pool, tool_filter=["run_visible"])
+    other = PooledMcpToolset(session_pool=pool, tool_filter=["make_plot"])
+
+    async def create_session(headers=None):
+        raise ConnectionError("no R server")
+
+    pool.create_session = create_session
+
+    async def reuse():
+        await toolset.close()
+        await other.close()
+        assert pool.closes == 1
+        # A new runner gets the tools again, which reopens the pool for the toolset
+        try:
+            await toolset.get_tools()
+        except ConnectionError:
+            pass
+        await other.close()
+        assert pool.closes == 1
+        await toolset.close()
+        assert pool.closes == 2
+
+    asyncio.run(reuse())
@@ -0,0 +1,83 @@
+"""
+Tests for the preprocess_messages callback.
+
+Usage (from the repository root): python -m pytest tests/test_preprocess_messages.py
+"""
+
+from google.adk.events import Event
+from google.adk.models import LlmRequest
+from google.genai import types
+from types import SimpleNamespace
+from pathlib import Path
+import asyncio
+import copy
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from PlotMyData.agent import CHECKED_EVENT_KEY, FILE_MARKER, preprocess_messages
+
+
+class CountingEvent(Event):
+    """
+    Session event that counts how many times its author or content is read.
+    """
+
+    reads: int = 0
+
+    def __getattribute__(self, name):
+        if name in ("author", "content"):
+            object.__setattr__(self, "reads", object.__getattribute__(self, "reads") + 1)
+        return super().__getattribute__(name)
+
+
+def make_event(i: int) -> Event:
+    """
+    Make a session event; every 10th event is a user message with an uploaded file.
+    """
+    if i % 10 == 0:
+        text = f'Plot the data\n[Uploaded Artifact: "data-{i}.csv"]'
+        role, author = "user", "user"
+    else:
+        text = f"Response {i}"
+        role, author = "model", "Coordinator"
+    return CountingEvent(author=author, content=types.Content(role=role, parts=[types.Part(text=text)]))
+
+
+async def model_call(callback_context) -> LlmRequest:
+    """
+    Run the callback on a request built from copies of the session events (as in ADK).
+    """
+    events = callback_context.session.events
+    contents = [copy.deepcopy(object.__getattribute__(event, "content")) for event in events]
+    llm_request = LlmRequest(contents=contents)
+    for event in events:
+        event.reads = 0
+    await preprocess_messages(callback_context, llm_request)
+    return llm_request
+
+
+def test_only_new_events_are_inspected():
+    session = SimpleNamespace(id="test", events=[make_event(i) for i in range(100)])
+    callback_context = SimpleNamespace(session=session, state={})
+
+    llm_request = asyncio.run(model_call(callback_context))
+    assert sum(event.reads > 0 for event in session.events) == 100
+    assert callback_context.state[CHECKED_EVENT_KEY] == session.events[-1].id
+    assert all(FILE_MARKER in content.parts[-1].text for content in llm_request.contents[::10])
+
+    # Second call: only the three new events are inspected
+    session.events.extend(make_event(i) for i in range(100, 103))
+    llm_request = asyncio.run(model_call(callback_context))
+    assert sum(event.reads > 0 for event in session.events) == 3
+    assert callback_context.state[CHECKED_EVENT_KEY] == session.events[-1].id
+    # The new upload and the earlier uploads (rewritten in the session events) point to the files
+    assert all(FILE_MARKER in content.parts[-1].text for content in llm_request.contents[::10])
+    assert "Uploaded Artifact" not in str(llm_request.contents)
+
+
+def test_no_new_events():
+    session = SimpleNamespace(id="test", events=[make_event(i) for i in range(5)])
+    callback_context = SimpleNamespace(session=session, state={})
+    asyncio.run(model_call(callback_context))
+    asyncio.run(model_call(callback_context))
+    assert sum(event.reads > 0 for event in session.events) == 0
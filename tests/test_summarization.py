@@ -0,0 +1,66 @@
+"""
+Tests for the summarization policy.
+
+Usage (from the repository root): python -m pytest tests/test_summarization.py
+"""
+
+from google.adk.events import Event, EventActions
+from google.genai import types
+from pathlib import Path
+from types import SimpleNamespace
+import asyncio
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from PlotMyData import metrics
+from PlotMyData.summarization import STATE_KEY, apply_summarization_policy
+
+
+def run_policy(tool_name, agent_name, args, text, events=()):
+    """
+    Run the policy on a successful tool result and return the tool context.
+    """
+    tool_context = SimpleNamespace(
+        agent_name=agent_name,
+        invocation_id="turn",
+        state={},
+        actions=EventActions(),
+        session=SimpleNamespace(events=list(events)),
+    )
+    tool_response = {"content": [{"type": "text", "text": text}], "isError": False}
+    asyncio.run(apply_summarization_policy(SimpleNamespace(name=tool_name), args, tool_context, tool_response))
+    return tool_context
+
+
+def transfer(author, agent_name):
+    """
+    Make an event for a transfer in this turn.
+    """
+    call = types.FunctionCall(name="transfer_to_agent", args={"agent_name": agent_name})
+    return Event(invocation_id="turn", author=author, content=types.Content(role="model", parts=[types.Part(function_call=call)]))
+
+
+def test_plot_skip_is_counted_as_avoided():
+    metrics.reset()
+    tool_context = run_policy("make_plot", "Plot", {"code": "plot(1:10)"}, "iVBORw0KGgo")
+    assert tool_context.actions.skip_summarization
+    assert tool_context.state[STATE_KEY] == 1
+    assert metrics.counters["llm_calls_avoided"] == 1
+
+
+def test_return_is_counted_separately():
+    metrics.reset()
+    args = {"code": 'check_packages(c("ggrepel"))'}
+    events = [transfer("Plot", "Install")]
+    tool_context = run_policy("run_visible", "Install", args, "ggrepel is already installed", events)
+    # The Plot agent calls its model next, so no model call is counted as avoided
+    assert tool_context.actions.transfer_to_agent == "Plot"
+    assert not tool_context.actions.skip_summarization
+    assert STATE_KEY not in tool_context.state
+    assert metrics.counters["llm_calls_avoided"] == 0
+    assert metrics.counters["summary_returns"] == 1
+
+    # Without an agent to return to, the turn ends
+    tool_context = run_policy("run_visible", "Install", args, "ggrepel is already installed", [transfer("Coordinator", "Install")])
+    assert tool_context.actions.skip_summarization
+    assert metrics.counters["llm_calls_avoided"] == 1
@@ -0,0 +1,89 @@
+"""
+Tests for TurnMetricsPlugin.
+
+Usage (from the repository root): python -m pytest tests/test_turn_metrics.py
+"""
+
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.runners import InMemoryRunner
+from google.genai import types
+from pathlib import Path
+from typing import AsyncGenerator
+import asyncio
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from PlotMyData import metrics
+from PlotMyData.agent import TurnMetricsPlugin, r_server, root_agent
+
+
+class TransferringLlm(BaseLlm):
+    """
+    Model that transfers to the Plot agent on the first call and then answers.
+    """
+
+    model: str = "transferring"
+    calls: int = 0
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        self.calls += 1
+        if self.calls == 1:
+            part = types.Part(
+                function_call=types.FunctionCall(name="transfer_to_agent", args={"agent_name": "Plot"})
+            )
+        else:
+            part = types.Part(text="Done")
+        yield LlmResponse(content=types.Content(role="model", parts=[part]))
+
+
+def set_model(agent, model):
+    """
+    Set the model of an agent and its sub-agents, returning the old models.
+    """
+    old = {agent.name: agent.model}
+    agent.model = model
+    for sub_agent in agent.sub_agents:
+        old.update(set_model(sub_agent, model))
+    return old
+
+
+def test_every_turn_is_timed(monkeypatch):
+    selected = []
+
+    async def create_session(headers=None):
+        selected.append(headers)
+
+    monkeypatch.setattr(r_server, "create_session", create_session)
+    # The R tools aren't needed to transfer and answer
+    for agent in [root_agent, *root_agent.sub_agents]:
+        monkeypatch.setattr(agent, "tools", [])
+    old_models = set_model(root_agent, TransferringLlm())
+    metrics.reset()
+    try:
+        runner = InMemoryRunner(agent=root_agent, plugins=[TurnMetricsPlugin()])
+
+        async def run_turns():
+            session = await runner.session_service.create_session(app_name=runner.app_name, user_id="user")
+            authors = []
+            for text in ["Plot the mtcars dataset", "Now make the points red"]:
+                message = types.Content(role="user", parts=[types.Part(text=text)])
+                turn = [event.author async for event in runner.run_async(
+                    user_id="user", session_id=session.id, new_message=message
+                )]
+                authors.append(turn)
+            return authors
+
+        authors = asyncio.run(run_turns())
+    finally:
+        for agent in [root_agent, *root_agent.sub_agents]:
+            agent.model = old_models[agent.name]
+
+    # The second turn starts at the Plot agent, without the callbacks of the root agent
+    assert authors[0][0] == "Coordinator"
+    assert authors[1] == ["Plot"]
+    assert len(selected) == 2
+    timings = metrics.summary()["timings"]
+    assert timings["turn"]["count"] == 2
+    assert timings["select_r_session"]["count"] == 2